@@ -8,13 +8,21 @@ This is a serverless function optimized for Vercel deployment.
 """
 
 import os
-from flask import Flask, render_template, request, jsonify, send_file
-from openai import OpenAI
-import base64
-import traceback
+import logging
+from flask import Flask, render_template, request, jsonify, Response
+from flask.json.provider import DefaultJSONProvider
+import binascii
+import hashlib
 import json
 import re
 import io
+import threading
+import time
+import unicodedata
+from urllib.parse import quote
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 # Base directory for absolute paths (templates, static, .env)
 base_dir = os.path.abspath(os.path.dirname(__file__))
@@ -30,20 +38,82 @@ except ImportError:
     # Vercel uses System Environment Variables anyway.
     pass
 
+# Logging: LOG_LEVEL=DEBUG shows the per-request scan details.
+# Log calls use lazy %-formatting, so disabled levels cost almost nothing.
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
+logger = logging.getLogger(__name__)
+
 # Optional imports with fallbacks
+# PyMuPDF (PDF processing) takes ~90ms to import and is only needed for PDF
+# receipts, so load_fitz() imports it on first use instead of at cold start.
+fitz = None
+fitz_checked = False
+
+
+def load_fitz():
+    """
+    Import PyMuPDF on first use. Returns the module, or None if not installed.
+    """
+    global fitz, fitz_checked
+    if not fitz_checked:
+        try:
+            import fitz as fitz_module
+            fitz = fitz_module
+        except ImportError:
+            logger.warning("PyMuPDF not installed. PDF processing will be disabled.")
+        fitz_checked = True
+    return fitz
+
 try:
-    import fitz  # PyMuPDF for PDF processing
+    import orjson  # Faster JSON parsing (optional)
 except ImportError:
-    print("WARNING: PyMuPDF not installed. PDF processing will be disabled.")
-    fitz = None
+    orjson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers can
+# catch json.JSONDecodeError either way
+json_loads = orjson.loads if orjson is not None else json.loads
 
 try:
-    from PIL import Image, ImageEnhance, ImageFilter
+    from PIL import Image, ImageFilter, ImageStat
 except ImportError:
-    print("WARNING: Pillow not installed. Image preprocessing will be disabled.")
+    logger.warning("Pillow not installed. Image preprocessing will be disabled.")
     Image = None
-    ImageEnhance = None
     ImageFilter = None
+    ImageStat = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson, so jsonify() and request.get_json()
+    skip the pure-Python parts of the stdlib json module.
+    
+    Output matches Flask's default provider in what it encodes: sorted keys,
+    indented output in debug mode, and Flask's default() for Decimal, date /
+    datetime (HTTP date strings) and dataclasses - orjson would otherwise
+    encode dates as ISO strings itself, so they are passed through to it.
+    Integers wider than 64 bits, which orjson rejects, fall back to the
+    stdlib encoder. Unlike Flask's default, non-ASCII text is written as
+    UTF-8 rather than \\u escapes (both are valid JSON).
+    """
+
+    def dumps(self, obj, **kwargs):
+        option = (orjson.OPT_NON_STR_KEYS
+                  | orjson.OPT_PASSTHROUGH_DATETIME
+                  | orjson.OPT_PASSTHROUGH_DATACLASS)
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        except orjson.JSONEncodeError:
+            # e.g. an int outside the 64-bit range - let Flask's json.dumps
+            # handle it (it also raises the usual TypeError for types neither supports)
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 # Initialize Flask app with explicit template/static folders (absolute paths)
 app = Flask(
@@ -51,6 +121,8 @@ app = Flask(
     template_folder=os.path.join(base_dir, 'templates'),
     static_folder=os.path.join(base_dir, 'static'),
 )
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 
 # Secret key for flash messages
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -58,8 +130,69 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-i
 # Max content length: 10MB for Vercel serverless
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024
 
-# Lazy-initialized OpenAI client (set inside route to avoid startup crashes)
+# Longest side (px) of the receipt image sent to the vision model.
+# Bigger images only add vision tokens and upload time without better OCR.
+RECEIPT_MAX_DIM = int(os.environ.get('RECEIPT_MAX_DIM', 1536))
+
+# Images at or below this size are sent with detail="low" (fixed token cost)
+LOW_DETAIL_MAX_DIM = 768
+
+# Grayscale uploads up to this size skip contrast/sharpen preprocessing
+SMALL_IMAGE_MAX_DIM = 1024
+
+# Largest image (in pixels) we are willing to decode; a 5MB upload can
+# otherwise expand into gigabytes of pixels. 40 MP covers any phone camera.
+MAX_RECEIPT_PIXELS = 40_000_000
+
+# JPEG uploads up to this size (and within RECEIPT_MAX_DIM) are sent as-is
+JPEG_PASSTHROUGH_MAX_BYTES = 300 * 1024
+
+# Upper bound on PDF render resolution; enough for small receipt print
+PDF_RENDER_DPI = 200
+
+# JPEG quality for images sent to the vision API. Receipt text stays legible
+# at 75 for photos (~25% smaller than 85); clean PDF renders get a bit more.
+PHOTO_JPEG_QUALITY = 75
+PDF_JPEG_QUALITY = 80
+
+# Photos whose Laplacian variance (sharpness) is above this are already crisp
+# and are not sharpened. Logged at DEBUG level for tuning.
+SHARP_IMAGE_MIN_VARIANCE = float(os.environ.get('SHARP_IMAGE_MIN_VARIANCE', 100))
+
+# Photos whose luminance standard deviation is below this are low-contrast
+# (faded print, shadows) and get a contrast boost. Logged with sharpness.
+LOW_CONTRAST_MAX_STDDEV = float(os.environ.get('LOW_CONTRAST_MAX_STDDEV', 45))
+
+
+def create_openai_client():
+    """
+    Create the OpenAI client, or return None if no API key is configured.
+    The SDK keeps a pool of keep-alive connections per client, so reusing one
+    client lets warm invocations skip the TCP/TLS handshake.
+    
+    The openai package is imported here rather than at module level: it takes
+    ~400ms to import, which page routes would otherwise pay on cold start.
+    """
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        return None
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
+
+
+# Shared OpenAI client, created by get_openai_client() on the first scan and
+# reused by warm invocations. Stays None if the key is missing or init fails.
 client = None
+# Guards the lazy creation in get_openai_client()
+client_lock = threading.Lock()
+# Creates the client off the request thread, see start_openai_client_init()
+client_init_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='openai-init')
+
+# Raw GPT-4o answers by request hash (see receipt_request_key), so repeated
+# uploads of the same receipt skip the API call. Per warm instance, LRU.
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 64))
+response_cache = OrderedDict()
+response_cache_lock = threading.Lock()
 
 
 @app.route('/')
@@ -107,147 +240,126 @@ def clients():
     return render_template('clients.html')
 
 
-def resize_image_for_api(img, max_size=1500):
+def resize_image_for_api(img, max_size=RECEIPT_MAX_DIM):
     """
     Resize image to reduce payload size while maintaining quality.
-    Max dimension is 1500px by default.
-    """
-    width, height = img.size
+    Max dimension is RECEIPT_MAX_DIM (1536px) by default.
     
-    if width > max_size or height > max_size:
-        if width > height:
-            new_width = max_size
-            new_height = int(height * (max_size / width))
-        else:
-            new_height = max_size
-            new_width = int(width * (max_size / height))
-        
-        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    Runs before contrast/sharpen so those filters touch fewer pixels.
+    """
+    if max(img.size) > max_size:
+        # thumbnail() keeps aspect ratio and never upscales
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
     
     return img
 
 
-@app.route('/scan-receipt', methods=['POST'])
-def scan_receipt():
+def ensure_rgb(img):
     """
-    Route to scan receipt images using OpenAI Vision API (GPT-4o - best model).
-    Serverless version: processes files from memory only (no disk saving).
-    Includes image resizing for Vercel payload limits.
+    Return the image in RGB mode.
+    Unlike img.convert('RGB'), this skips the full-image copy for RGB sources
+    (most JPEG photos).
     """
-    # Define valid categories - MUST match frontend dropdown options exactly
-    VALID_CATEGORIES = ["Maistas", "Transportas", "Nuoma", "Komunaliniai", "Biuras", "Švara", "Buitinė chemija", "Paslaugos", "Kiti"]
+    if img.mode == 'RGB':
+        return img
+    return img.convert('RGB')
 
-    try:
-        print("--- STARTING SCAN ---")
-        
-        # Check if file was uploaded
-        if 'file' not in request.files:
-            return jsonify({"error": "Nepateiktas failas"}), 400
-        
-        file = request.files['file']
-        
-        if not file.filename:
-            return jsonify({"error": "Tuščias failas"}), 400
-        
-        # Get file extension
-        filename = file.filename
-        file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-        
-        # Validate file extension
-        ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
-        if file_ext not in ALLOWED_EXTENSIONS:
-            return jsonify({"error": f"Netinkamas failo formatas. Leidžiami: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
-        
-        # Read file into memory (no disk saving for serverless)
-        file_bytes = file.read()
-        
-        # Check file size (max 5MB for images to avoid Vercel limits)
-        file_size_mb = len(file_bytes) / (1024 * 1024)
-        print(f"File size: {file_size_mb:.2f} MB")
-        
-        if file_size_mb > 5:
-            return jsonify({"error": "Failas per didelis. Maksimalus dydis: 5MB"}), 400
-        
-        # Generate a unique filename for response (not saved to disk)
-        from datetime import datetime
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        unique_filename = f"receipt_{timestamp}.{file_ext}"
-        
-        # STEP 2: Preprocess and resize image for better OCR accuracy
-        try:
-            if Image is None:
-                # Fallback: use original image if PIL not available
-                base64_image = base64.b64encode(file_bytes).decode('utf-8')
-                mime_type = 'image/jpeg'
-            elif file_ext == 'pdf':
-                # PDF: Convert to image first, then preprocess
-                if fitz is None:
-                    return jsonify({"error": "PDF apdorojimui reikalingas PyMuPDF"}), 400
-                
-                doc = fitz.open(stream=file_bytes, filetype="pdf")
-                page = doc.load_page(0)
-                # Higher resolution for PDF
-                mat = fitz.Matrix(2.0, 2.0)  # 2x zoom for better quality
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
-                doc.close()
-                
-                # Open PDF image and preprocess
-                img = Image.open(io.BytesIO(img_data))
-                img = resize_image_for_api(img, max_size=2000)  # Larger for PDF
-                img = img.convert('RGB')  # Convert to RGB (no grayscale for better color recognition)
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(1.5)  # Moderate contrast
-                img = img.filter(ImageFilter.SHARPEN)  # Sharpen
-                
-                # Save to buffer as JPEG (smaller than PNG)
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=85)
-                processed_bytes = buffer.getvalue()
-                base64_image = base64.b64encode(processed_bytes).decode('utf-8')
-                mime_type = 'image/jpeg'
-            else:
-                # Image file: Preprocess directly
-                img = Image.open(io.BytesIO(file_bytes))
-                img = resize_image_for_api(img, max_size=1500)  # Resize for API
-                img = img.convert('RGB')  # Keep colors for better recognition
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(1.3)  # Light contrast boost
-                img = img.filter(ImageFilter.SHARPEN)  # Sharpen
-                
-                # Save to buffer as JPEG (smaller than PNG)
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=85)
-                processed_bytes = buffer.getvalue()
-                base64_image = base64.b64encode(processed_bytes).decode('utf-8')
-                mime_type = 'image/jpeg'
-            
-            # Log processed image size
-            processed_size_kb = len(processed_bytes) / 1024
-            print(f"Processed image size: {processed_size_kb:.1f} KB")
-                
-        except Exception as e:
-            # Fallback: use original image if preprocessing fails
-            print(f"Image preprocessing error: {e}, using original image")
-            base64_image = base64.b64encode(file_bytes).decode('utf-8')
-            mime_type = f'image/{file_ext}' if file_ext != 'jpg' else 'image/jpeg'
-        
-        # Get / lazy-init OpenAI client in a crash-proof way
-        global client
-        if client is None:
-            api_key = os.environ.get('OPENAI_API_KEY')
-            if not api_key:
-                return jsonify({"error": "OpenAI API raktas nesukonfigūruotas"}), 500
-            try:
-                client = OpenAI(api_key=api_key)
-            except Exception as e:
-                print(f"OpenAI client initialization error: {e}")
-                return jsonify({"error": f"Nepavyko inicializuoti OpenAI: {str(e)}"}), 500
-        
-        # STEP 3: Build system prompt for Lithuanian receipt digitization - ULTRA PRECISE
-        STRICT_CATEGORIES = ["Maistas", "Transportas", "Nuoma", "Komunaliniai", "Biuras", "Švara", "Buitinė chemija", "Paslaugos", "Kiti"]
-        
-        system_prompt = f"""# LIETUVIŠKŲ ČEKIŲ OCR ROBOTAS - 100% TIKSLUMAS
+
+def boost_contrast(img, contrast):
+    """
+    Boost the contrast of an RGB or grayscale (L) image.
+    
+    Gives the same result as ImageEnhance.Contrast(img).enhance(contrast),
+    but as one lookup-table pass instead of grayscale copy + stats + blend.
+    Grayscale images stay single-channel, so there are 3x fewer pixels to
+    process than after an RGB conversion.
+    """
+    # Mean luminance, from the per-band histograms (no grayscale copy)
+    if img.mode == 'L':
+        mean = int(ImageStat.Stat(img).mean[0] + 0.5)
+    else:
+        r, g, b = ImageStat.Stat(img).mean
+        mean = int(0.299 * r + 0.587 * g + 0.114 * b + 0.5)
+    lut = [min(255, max(0, int(mean + contrast * (v - mean)))) for v in range(256)]
+    return img.point(lut * len(img.getbands()))
+
+
+def enhance_for_ocr(img, contrast):
+    """Boost contrast and sharpen an RGB or grayscale (L) image for better OCR."""
+    return boost_contrast(img, contrast).filter(ImageFilter.SHARPEN)
+
+
+# 3x3 Laplacian; the 128 offset keeps negative responses inside 0-255
+LAPLACIAN_KERNEL = (0, 1, 0, 1, -4, 1, 0, 1, 0)
+
+
+def measure_image_quality(img):
+    """
+    Return (contrast, sharpness) of an image, from one grayscale copy.
+    
+    contrast is the standard deviation of luminance: faded or shadowed
+    receipts score low. sharpness is the variance of the Laplacian: blurry
+    photos score low (tens), crisp text in the hundreds or more.
+    """
+    gray = img if img.mode == 'L' else img.convert('L')
+    contrast = ImageStat.Stat(gray).stddev[0]
+    edges = gray.filter(ImageFilter.Kernel((3, 3), LAPLACIAN_KERNEL, scale=1, offset=128))
+    return contrast, ImageStat.Stat(edges).var[0]
+
+
+def encode_image_for_api(img, quality=PHOTO_JPEG_QUALITY):
+    """
+    Encode a preprocessed image as optimized, progressive JPEG bytes.
+    For receipts JPEG is 3-6x smaller than PNG, so less base64 and upload time.
+    Progressive encoding shaves another ~7% off at the same quality.
+    """
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def image_data_url(image_bytes, mime_type):
+    """
+    Build the base64 data URL the vision API expects.
+    b2a_base64 encodes in one C call without the trailing newline, and the
+    ASCII result is decoded once, straight into the final string.
+    """
+    encoded = binascii.b2a_base64(image_bytes, newline=False)
+    return f"data:{mime_type};base64,{encoded.decode('ascii')}"
+
+
+def pdf_render_zoom(page, max_size=RECEIPT_MAX_DIM):
+    """
+    Pick the PyMuPDF zoom factor for rendering a PDF page.
+    Small pages (e.g. narrow receipts) are rendered at up to PDF_RENDER_DPI
+    for sharper text; large pages are rendered straight at the target size
+    instead of being downscaled afterwards.
+    """
+    longest_side = max(page.rect.width, page.rect.height)
+    if longest_side <= 0:
+        return 1.0
+    # PDF user space is 72 points per inch
+    max_zoom = PDF_RENDER_DPI / 72
+    return max(1.0, min(max_zoom, max_size / longest_side))
+
+
+# Receipt upload formats accepted by /scan-receipt
+ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'pdf'})
+# Largest accepted receipt upload (5MB, to stay well within Vercel limits)
+MAX_RECEIPT_BYTES = 5 * 1024 * 1024
+
+# Valid expense categories - MUST match frontend dropdown options exactly
+RECEIPT_CATEGORIES = ["Maistas", "Transportas", "Nuoma", "Komunaliniai", "Biuras", "Švara", "Buitinė chemija", "Paslaugos", "Kiti"]
+VALID_CATEGORIES = frozenset(RECEIPT_CATEGORIES)
+# Lowercase name -> canonical category, for case-insensitive matching
+CATEGORY_BY_LOWER = {category.lower(): category for category in RECEIPT_CATEGORIES}
+
+# Markdown code fences the model sometimes wraps around its JSON
+CODE_FENCE_RE = re.compile(r'```json|```')
+
+# System prompt for Lithuanian receipt digitization - ULTRA PRECISE
+# Built once at import time; it does not depend on the request.
+RECEIPT_SYSTEM_PROMPT = f"""# LIETUVIŠKŲ ČEKIŲ OCR ROBOTAS - 100% TIKSLUMAS
 
 Tu esi PROFESIONALUS lietuviškų čekių skaitytuvas. Tavo VIENINTELĖ užduotis - TIKSLIAI perskaityti kiekvieną simbolį.
 
@@ -281,7 +393,7 @@ Kiekviena eilutė paprastai yra: [PRODUKTO PAVADINIMAS] [KAINA]
 - Ignoruok kiekį ir vienetų kainas - imk TIK galutinę kainą
 
 ### 4. KATEGORIJOS (PRIVALOMA naudoti TIK šias):
-{STRICT_CATEGORIES}
+{RECEIPT_CATEGORIES}
 
 Kategorijų logika:
 - Bet koks maistas/gėrimas → "Maistas"
@@ -326,19 +438,15 @@ Kategorijų logika:
 - "VIADA" → "Viada"
 
 ## ❌ KO NEDARYTI:
-- NEVERSK produktų į anglų kalbą
 - NESUGALVOK produktų pavadinimų - jei nematai, nerašyk
 - NESUMUOK kelių produktų į vieną
 - NEPRALEISK jokių eilučių
 - NEINTERPRETUOK - tik kopijuok
 
 ## ✅ KĄ DARYTI:
-- Kopijuok TIKSLIAI simbolis po simbolio kaip parašyta
 - Išlaikyk didžiąsias/mažąsias raides kaip originale
 - Išlaikyk sutrumpinimus (pvz. "POM.TRINT." ne "Pomidorų trintukas")
 - Išlaikyk skaičius ir vienetų matavimus (pvz. "500G", "2.5%", "1L")
-- Jei matai "PIENAS ROKIŠKIO 2.5% 1L" - rašyk tiksliai taip, ne "Pienas"
-- Jei neįskaitoma - PRALEISK, bet NESUGALVOK
 
 ## 🔍 PAVYZDŽIAI:
 Čekyje: "SVIEST.ROKIŠKIO 82% 200G" → description: "SVIEST.ROKIŠKIO 82% 200G"
@@ -347,293 +455,694 @@ Kategorijų logika:
 Čekyje: "KEFYRAS 2.5% 1L" → description: "KEFYRAS 2.5% 1L"
 
 NEGALIMA: "Pienas", "Sviestas", "Duona" - tai PER TRUMPA! Kopijuok visą eilutę."""
-        
-        # User prompt - very specific
-        user_prompt = """TIKSLIAI nuskaityk šį lietuvišką čekį kaip OCR skaitytuvas.
+
+# User prompt - very specific
+RECEIPT_USER_PROMPT = """TIKSLIAI nuskaityk šį lietuvišką čekį kaip OCR skaitytuvas.
 
 INSTRUKCIJOS:
 1. Rask parduotuvės pavadinimą viršuje (pvz. MAXIMA, LIDL, IKI)
 2. Rask datą (formatas YYYY-MM-DD)
-3. Kiekvieną produkto eilutę KOPIJUOK SIMBOLIS PO SIMBOLIO:
-   - Išlaikyk VISUS žodžius, skaičius, sutrumpinimus
-   - Pvz. "SVIEST.ROKIŠKIO 82% 200G" → būtent taip, ne "Sviestas"
-   - Pvz. "KEFYRAS VILKYŠKIŲ 2.5% 1L" → būtent taip, ne "Kefyras"
+3. Kiekvieną produkto eilutę KOPIJUOK SIMBOLIS PO SIMBOLIO,
+   išlaikydamas VISUS žodžius, skaičius, sutrumpinimus
 4. Kainą imk iš dešinės pusės
 5. Kategoriją priskirk pagal produkto tipą
 
 ⚠️ KRITIŠKAI SVARBU:
 - description = TIKSLUS čekio tekstas, ne sutrumpinimas
-- Jei čekyje parašyta "DUONA BALTA VILNIAUS 400G" - grąžink tiksliai tai
-- NEGALIMA grąžinti tik "Duona" ar "Pienas" - tai per trumpa!
 - Grąžink JSON su visais produktais."""
 
-        # API Call with JSON response format - using GPT-4o (best vision model)
-        print("Calling OpenAI API with GPT-4o...")
+# Appended to the user prompt when several receipts are sent in one request
+RECEIPT_BATCH_PROMPT = """
+
+📎 SIUNČIAMI KELI ČEKIAI ({count}) - kiekviena nuotrauka yra atskiras čekis.
+Grąžink JSON: {{"receipts": [{{"items": [...]}}, ...]}}
+- po vieną objektą kiekvienam čekiui, TA PAČIA tvarka kaip nuotraukos."""
+
+# Max files per /scan-receipts-batch request (keeps the payload and output in limits)
+MAX_BATCH_FILES = 10
+
+
+# Category keywords (Lithuanian + English), checked in priority order.
+# Each list is compiled into one regex, so matching a text against a whole
+# category is a single C-level scan instead of a Python loop over substrings.
+CATEGORY_KEYWORDS = [
+    ('Maistas', [
+        'maistas', 'food', 'grocer', 'restaurant', 'cafe', 'meal', 'snack',
+        'duona', 'pienas', 'sviestas', 'kiaušin', 'mėsa', 'višt', 'kiaul', 'jautien',
+        'žuvis', 'lašiš', 'sūris', 'varškė', 'grietin', 'jogurt', 'kefyr',
+        'alus', 'vynas', 'sult', 'vanduo', 'kava', 'arbata', 'gėrim',
+        'cukrus', 'druska', 'milt', 'ryži', 'makaron', 'bulv', 'mork',
+        'svogūn', 'pomidor', 'agurk', 'obuol', 'banan', 'apelsin',
+        'saldain', 'šokolad', 'led', 'pyrag', 'bandel', 'sumuštini',
+        'maxima', 'iki', 'lidl', 'rimi', 'norfa', 'bread', 'milk', 'cheese',
+        'kebab', 'pica', 'pizza', 'burger', 'kavin', 'restoran',
+    ]),
+    ('Transportas', [
+        'transportas', 'fuel', 'gas', 'parking', 'transport', 'car', 'taxi',
+        'degalai', 'benzin', 'dyzel', 'diesel', 'parkav', 'plovykl',
+        'tepal', 'aušin', 'circle k', 'viada', 'orlen', 'neste',
+        'autoservis', 'autobus', 'traukin', 'taksi',
+    ]),
+    ('Buitinė chemija', [
+        'buitin', 'chemij', 'detergent', 'soap', 'shampoo', 'washing', 'chemical', 'hygiene', 'household',
+        'skalbim', 'plovikl', 'valikl', 'dezodorant', 'šampūn', 'muil',
+        'dantų past', 'tualetinis popier', 'servetėl', 'kapsul', 'minkštikl',
+        'balikl', 'higienos', 'wc', 'grindų',
+    ]),
+    ('Biuras', [
+        'office', 'stationery', 'paper', 'pen', 'printer', 'biuras',
+        'popier', 'rašikl', 'sąsiuvin', 'segtuk', 'vokai', 'spausdint', 'rašal',
+        'kanceliar',
+    ]),
+    ('Komunaliniai', [
+        'utility', 'electric', 'water', 'internet', 'phone', 'komunalin',
+        'elektr', 'vanden', 'duj', 'šildym', 'telefon', 'telia', 'tele2', 'bite',
+    ]),
+    ('Švara', ['clean', 'valym', 'švara']),
+    ('Nuoma', ['rent', 'lease', 'nuom', 'būst']),
+    ('Paslaugos', ['service', 'repair', 'paslaug', 'remont', 'konsult']),
+]
+
+CATEGORY_KEYWORD_PATTERNS = [
+    (category, re.compile('|'.join(re.escape(kw) for kw in keywords)))
+    for category, keywords in CATEGORY_KEYWORDS
+]
+
+
+# Keys the model may put the item list under, in priority order
+RESPONSE_ITEM_KEYS = {'items': 0, 'expenses': 1, 'products': 2, 'receipt_items': 3}
+
+# Fields every receipt item must have (plus 'amount' or 'total_amount')
+REQUIRED_ITEM_FIELDS = frozenset({'vendor', 'date', 'category'})
+
+
+def is_receipt_item(data):
+    """Check that data is a dict with the required receipt item fields and an amount."""
+    return (isinstance(data, dict)
+            and data.keys() >= REQUIRED_ITEM_FIELDS
+            and ('total_amount' in data or 'amount' in data))
+
+
+def find_response_items(data):
+    """
+    Find the item list in a parsed AI response dictionary.
+    
+    Single pass over the dictionary: a known key (by RESPONSE_ITEM_KEYS
+    priority) wins, otherwise the first list value is used. If there is
+    neither, the dictionary itself may be a single item.
+    Returns None if nothing usable is found.
+    """
+    items = None
+    items_rank = len(RESPONSE_ITEM_KEYS)
+    first_list = None
+    for key, value in data.items():
+        rank = RESPONSE_ITEM_KEYS.get(key)
+        if rank is not None and rank < items_rank and value is not None:
+            items, items_rank = value, rank
+        elif first_list is None and isinstance(value, list):
+            first_list = value
+    
+    if items is not None:
+        return items
+    if first_list is not None:
+        return first_list
+    if is_receipt_item(data):
+        return [data]
+    return None
+
+
+# Drops currency symbols and turns a decimal comma into a dot, in one pass
+AMOUNT_TRANSLATION = str.maketrans({'€': None, '$': None, ',': '.'})
+
+
+def parse_amount(value):
+    """
+    Parse a money amount from the AI response, e.g. "1,29 €" -> 1.29.
+    Numbers are returned unchanged; returns None if the value is not a number.
+    """
+    if isinstance(value, str):
+        cleaned = value.translate(AMOUNT_TRANSLATION).strip()
         try:
-            completion = client.chat.completions.create(
-                model="gpt-4o",  # Best model for vision tasks
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": user_prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_type};base64,{base64_image}",
-                                    "detail": "high"  # High detail for better OCR
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=4000,
-                response_format={"type": "json_object"}
-            )
-        except Exception as api_error:
-            print(f"OpenAI API Error: {api_error}")
-            error_msg = str(api_error)
-            if "rate_limit" in error_msg.lower():
-                return jsonify({"error": "API limitas pasiektas. Bandykite vėliau."}), 429
-            elif "invalid_api_key" in error_msg.lower():
-                return jsonify({"error": "Neteisingas API raktas"}), 401
-            elif "content_policy" in error_msg.lower():
-                return jsonify({"error": "Vaizdas neatitinka turinio politikos"}), 400
+            return float(cleaned)
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)):
+        return value
+    return None
+
+
+def match_category_keywords(text):
+    """
+    Return the first category (in priority order) whose keywords appear in text.
+    Returns None if no keyword matches.
+    """
+    for category, pattern in CATEGORY_KEYWORD_PATTERNS:
+        if pattern.search(text):
+            return category
+    return None
+
+
+class ReceiptScanError(Exception):
+    """
+    Receipt scanning error that is returned to the user as {"error": message}.
+    Messages are in Lithuanian because they are shown in the UI as-is.
+    """
+    
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def read_receipt_upload(file):
+    """
+    Read and validate one uploaded receipt file.
+    Returns (file_bytes, file_ext); raises ReceiptScanError if it is unusable.
+    """
+    if not file.filename:
+        raise ReceiptScanError("Tuščias failas")
+    
+    # Get file extension ('' when there is none)
+    file_ext = os.path.splitext(file.filename)[1][1:].lower()
+    
+    # Validate file extension
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise ReceiptScanError(f"Netinkamas failo formatas. Leidžiami: {', '.join(ALLOWED_EXTENSIONS)}")
+    if file_ext == 'pdf' and load_fitz() is None:
+        raise ReceiptScanError("PDF apdorojimui reikalingas PyMuPDF")
+    
+    # Read file into memory (no disk saving for serverless). Reading one byte
+    # past the limit is enough to detect oversized files, so they are
+    # rejected without loading the whole upload.
+    file_bytes = file.read(MAX_RECEIPT_BYTES + 1)
+    
+    # Check file size (max 5MB for images to avoid Vercel limits)
+    if len(file_bytes) > MAX_RECEIPT_BYTES:
+        raise ReceiptScanError("Failas per didelis. Maksimalus dydis: 5MB")
+    logger.info("File size: %.2f MB", len(file_bytes) / (1024 * 1024))
+    
+    return file_bytes, file_ext
+
+
+def prepare_receipt_image(file_bytes, file_ext):
+    """
+    Preprocess and resize a receipt for better OCR accuracy.
+    
+    Returns (image_data_url, image_detail) ready for the vision API.
+    Falls back to the original file if preprocessing fails. Only the data URL
+    outlives this call, so intermediate copies are freed before the API call.
+    Raises ReceiptScanError (413) for images above MAX_RECEIPT_PIXELS.
+    """
+    # Vision detail level: "auto" for unprocessed fallbacks (size unknown),
+    # otherwise decided from the final dimensions below
+    image_detail = "auto"
+    try:
+        if Image is None:
+            # Fallback: use original image if PIL not available
+            processed_bytes = file_bytes
+            mime_type = f'image/{file_ext}' if file_ext != 'jpg' else 'image/jpeg'
+        elif file_ext == 'pdf':
+            # PDF: Convert to image first, then preprocess
+            # "with" closes the document even if rendering fails, so MuPDF
+            # memory is released right away on warm serverless instances
+            with load_fitz().open(stream=file_bytes, filetype="pdf") as doc:
+                page = doc.load_page(0)
+                # Higher resolution for small PDF pages, capped at RECEIPT_MAX_DIM
+                zoom = pdf_render_zoom(page)
+                mat = fitz.Matrix(zoom, zoom)
+                pix = page.get_pixmap(matrix=mat, colorspace=fitz.csRGB, alpha=False)
+                # Copy raw RGB samples straight into Pillow (no PNG encode/decode).
+                # samples_mv is a view of the pixmap buffer, so the only copy
+                # is Pillow's own (pix.samples would make an extra bytes copy)
+                img = Image.frombytes('RGB', (pix.width, pix.height), pix.samples_mv)
+                page = pix = None
+            
+            # Preprocess the rendered page
+            img = resize_image_for_api(img)
+            img = ensure_rgb(img)  # RGB, no grayscale for better color recognition
+            img = enhance_for_ocr(img, 1.5)  # Moderate contrast + sharpen
+            
+            # Save as JPEG (several times smaller than PNG)
+            processed_bytes = encode_image_for_api(img, PDF_JPEG_QUALITY)
+            mime_type = 'image/jpeg'
+        else:
+            # Image file: Preprocess directly
+            # Image.open() only parses the header; pixels are decoded on first use
+            try:
+                img = Image.open(io.BytesIO(file_bytes))
+            except Image.DecompressionBombError:
+                img = None
+            # Reject decompression bombs from the header alone, before a
+            # small file can expand into gigabytes of pixels
+            if img is None or img.width * img.height > MAX_RECEIPT_PIXELS:
+                raise ReceiptScanError("Vaizdo raiška per didelė", 413)
+            if (img.format == 'JPEG' and img.mode in ('RGB', 'L')
+                    and len(file_bytes) <= JPEG_PASSTHROUGH_MAX_BYTES
+                    and max(img.size) <= RECEIPT_MAX_DIM):
+                # Already a small, right-sized JPEG (the expenses page compresses
+                # photos before upload): send the original bytes and skip
+                # decode + enhance + re-encode, which would only grow the file
+                logger.debug("Small JPEG upload, sending original bytes")
+                processed_bytes = file_bytes
             else:
-                return jsonify({"error": f"AI klaida: {error_msg[:200]}"}), 500
-        
-        # Get raw content from AI response
-        raw_content = completion.choices[0].message.content
-        
-        # Print what AI actually sent
-        print(f"DEBUG AI RAW: {raw_content[:500]}...")
-        
-        # Cleaning Logic
-        clean_json = re.sub(r'```json|```', '', raw_content).strip()
+                if img.mode == 'L' and max(img.size) <= SMALL_IMAGE_MAX_DIM:
+                    # Small grayscale scan/screenshot: contrast and sharpen add
+                    # little for OCR here, so send it as-is (1-channel JPEG)
+                    logger.debug("Small grayscale image, skipping enhancement")
+                else:
+                    img = resize_image_for_api(img)  # Resize for API
+                    if img.mode != 'L':
+                        # Keep colors for better recognition; grayscale scans
+                        # have none, so they are enhanced as one channel
+                        img = ensure_rgb(img)
+                    # Only fix what needs fixing: contrast for faded or
+                    # shadowed photos, sharpening for blurry ones
+                    contrast, sharpness = measure_image_quality(img)
+                    logger.debug("Image contrast (luminance stddev): %.1f, sharpness (Laplacian variance): %.1f",
+                                 contrast, sharpness)
+                    if contrast < LOW_CONTRAST_MAX_STDDEV:
+                        img = boost_contrast(img, 1.3)  # Light contrast boost
+                    if sharpness <= SHARP_IMAGE_MIN_VARIANCE:
+                        img = img.filter(ImageFilter.SHARPEN)
+                
+                # Save as JPEG (several times smaller than PNG)
+                processed_bytes = encode_image_for_api(img)
+            
+            mime_type = 'image/jpeg'
         
-        # Parse JSON
+        # Log processed image size
+        processed_size_kb = len(processed_bytes) / 1024
+        logger.info("Processed image size: %.1f KB, %dx%dpx", processed_size_kb, img.size[0], img.size[1])
+        # "low" is a fixed small token cost and enough for small images;
+        # "high" tiles larger images so fine receipt print stays readable
+        image_detail = "low" if max(img.size) <= LOW_DETAIL_MAX_DIM else "high"
+            
+    except ReceiptScanError:
+        raise
+    except Exception as e:
+        # Fallback: use original image if preprocessing fails
+        logger.warning("Image preprocessing error: %s, using original image", e)
+        processed_bytes = file_bytes
+        mime_type = f'image/{file_ext}' if file_ext != 'jpg' else 'image/jpeg'
+    
+    return image_data_url(processed_bytes, mime_type), image_detail
+
+
+def get_openai_client():
+    """
+    Return the shared OpenAI client, creating it on first use.
+    Raises ReceiptScanError (500) if it cannot be created.
+    """
+    global client
+    if client is None:
+        if not os.environ.get('OPENAI_API_KEY'):
+            raise ReceiptScanError("OpenAI API raktas nesukonfigūruotas", 500)
+        # Lock so concurrent requests on a threaded server build one client
+        # (and one connection pool), not one each
+        with client_lock:
+            if client is None:
+                try:
+                    client = create_openai_client()
+                except Exception as e:
+                    logger.error("OpenAI client initialization error: %s", e)
+                    raise ReceiptScanError(f"Nepavyko inicializuoti OpenAI: {str(e)}", 500)
+    return client
+
+
+def start_openai_client_init():
+    """
+    On a cold instance, start creating the OpenAI client in the background so
+    the openai import (~400ms) overlaps with image preprocessing.
+    get_openai_client() later waits on client_lock for it to finish; any
+    error is raised again there, so the future is not inspected.
+    """
+    if client is None and os.environ.get('OPENAI_API_KEY'):
+        client_init_executor.submit(get_openai_client)
+
+
+def receipt_request_key(user_prompt, images, max_tokens):
+    """
+    Content hash identifying a vision request: prompt, images and limits.
+    The system prompt and model are fixed per deployment, and the cache does
+    not outlive the process, so they are not part of the key.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{max_tokens}\0{user_prompt}".encode('utf-8'))
+    for image_data_url, image_detail in images:
+        digest.update(f"\0{image_detail}\0{image_data_url}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_cached_response(cache_key):
+    """Return the cached raw model answer for cache_key, or None."""
+    with response_cache_lock:
+        raw_content = response_cache.get(cache_key)
+        if raw_content is not None:
+            response_cache.move_to_end(cache_key)
+    return raw_content
+
+
+def cache_response(cache_key, raw_content):
+    """Store a raw model answer, evicting the least recently used ones."""
+    if RESPONSE_CACHE_SIZE <= 0:
+        return
+    with response_cache_lock:
+        response_cache[cache_key] = raw_content
+        response_cache.move_to_end(cache_key)
+        while len(response_cache) > RESPONSE_CACHE_SIZE:
+            response_cache.popitem(last=False)
+
+
+def request_receipt_json(user_prompt, images, max_tokens=4000):
+    """
+    Send receipt images to GPT-4o in a single request and return the parsed JSON.
+    
+    images is a list of (image_data_url, image_detail) pairs, as returned by
+    prepare_receipt_image(). Raises ReceiptScanError on API or format errors.
+    """
+    # Identical requests (re-uploads, retries) are answered from the cache
+    cache_key = receipt_request_key(user_prompt, images, max_tokens)
+    raw_content = get_cached_response(cache_key)
+    if raw_content is not None:
+        logger.info("Using cached OpenAI response")
+        return parse_receipt_json(raw_content)
+    
+    openai_client = get_openai_client()
+    
+    content = [{"type": "text", "text": user_prompt}]
+    for image_data_url, image_detail in images:
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": image_data_url,
+                "detail": image_detail  # see prepare_receipt_image()
+            }
+        })
+    
+    # API Call with JSON response format - using GPT-4o (best vision model)
+    logger.info("Calling OpenAI API with GPT-4o...")
+    try:
+        completion = openai_client.chat.completions.create(
+            model="gpt-4o",  # Best model for vision tasks
+            messages=[
+                {
+                    "role": "system",
+                    "content": RECEIPT_SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ],
+            max_tokens=max_tokens,
+            response_format={"type": "json_object"}
+        )
+    except Exception as api_error:
+        logger.error("OpenAI API Error: %s", api_error)
+        error_msg = str(api_error)
+        if "rate_limit" in error_msg.lower():
+            raise ReceiptScanError("API limitas pasiektas. Bandykite vėliau.", 429)
+        elif "invalid_api_key" in error_msg.lower():
+            raise ReceiptScanError("Neteisingas API raktas", 401)
+        elif "content_policy" in error_msg.lower():
+            raise ReceiptScanError("Vaizdas neatitinka turinio politikos", 400)
+        else:
+            raise ReceiptScanError(f"AI klaida: {error_msg[:200]}", 500)
+    
+    # Get raw content from AI response
+    raw_content = completion.choices[0].message.content
+    
+    # Log what AI actually sent
+    logger.debug("AI RAW: %.500s...", raw_content)
+    
+    data = parse_receipt_json(raw_content)
+    # Cache only responses that parsed, so a bad answer is not replayed
+    cache_response(cache_key, raw_content)
+    return data
+
+
+def parse_receipt_json(raw_content):
+    """
+    Parse the model's JSON answer. Raises ReceiptScanError if it is not JSON.
+    """
+    # json_object mode returns bare JSON, so parse it directly
+    # and only strip markdown code fences if that fails
+    try:
+        data = json_loads(raw_content)
+    except json.JSONDecodeError:
+        clean_json = CODE_FENCE_RE.sub('', raw_content).strip()
         try:
-            data = json.loads(clean_json)
-            print(f"DEBUG Parsed Data: {type(data)}")
+            data = json_loads(clean_json)
         except json.JSONDecodeError as je:
-            print(f"JSON PARSE ERROR: {je}")
-            return jsonify({"error": f"AI grąžino neteisingą formatą. Bandykite dar kartą."}), 500
-        
-        # EXTREMELY FLEXIBLE JSON PARSING LOGIC
-        items = None
-        
-        # 1. Direct List
-        if isinstance(data, list):
-            print("DEBUG: Data is a direct list, using as items")
-            items = data
+            logger.error("JSON PARSE ERROR: %s", je)
+            raise ReceiptScanError("AI grąžino neteisingą formatą. Bandykite dar kartą.", 500)
+    logger.debug("Parsed Data: %s", type(data))
+    
+    return data
+
+
+def extract_receipt_items(data):
+    """
+    Pull receipt items out of the parsed AI response and validate them.
+    
+    The model does not always follow the requested format, so this accepts
+    a bare list, a dict with the list under any key, or a single item.
+    Invalid items are dropped; amounts are parsed and categories normalized.
+    """
+    # EXTREMELY FLEXIBLE JSON PARSING LOGIC
+    items = None
+    
+    # 1. Direct List
+    if isinstance(data, list):
+        logger.debug("Data is a direct list, using as items")
+        items = data
+    
+    # 2. Dictionary Search
+    elif isinstance(data, dict):
+        logger.debug("Data is a dictionary, searching for items...")
+        items = find_response_items(data)
+    
+    # 3. Empty Fallback
+    if items is None:
+        logger.debug("No items found, returning empty list")
+        items = []
+    
+    # 4. Ensure items is a list
+    if not isinstance(items, list):
+        logger.debug("Items is not a list (type: %s), converting...", type(items))
+        items = [items] if items else []
+    
+    logger.debug("Final items count: %d", len(items))
+    
+    # Validate and clean each item; invalid ones normalize to None
+    normalized = (normalize_receipt_item(item) for item in items if is_receipt_item(item))
+    return [item for item in normalized if item is not None]
+
+
+def normalize_receipt_item(item):
+    """
+    Clean one receipt item in place: parse amounts and fix the category.
+    Returns the item, or None if its total is not a number.
+    """
+    # Normalize amount fields
+    if 'amount' in item and 'total_amount' not in item:
+        item['total_amount'] = item.pop('amount')
+    
+    # Parse amounts once; skip items whose total is not a number
+    total = parse_amount(item['total_amount'])
+    if total is None:
+        return None
+    item['total_amount'] = total
+    
+    # Handle vat_amount (defaults to 0.0)
+    vat = parse_amount(item.get('vat_amount', 0.0))
+    if vat is None:
+        vat = 0.0
+    item['vat_amount'] = vat
+    
+    # Handle net_amount (derived from total - VAT if missing or invalid)
+    net = parse_amount(item['net_amount']) if 'net_amount' in item else None
+    if net is None:
+        net = float(total - vat)
+    item['net_amount'] = net
+    
+    # STRICT Category Validation with Lithuanian keyword support
+    original_category = item.get('category', '').strip()
+    if original_category not in VALID_CATEGORIES:
+        item['category'] = resolve_category(original_category, item.get('description', ''))
+    
+    # Map total_amount to amount for frontend compatibility
+    item['amount'] = total
+    
+    return item
+
+
+def resolve_category(category, description):
+    """
+    Map a category the model made up to one of RECEIPT_CATEGORIES.
+    Tries a case-insensitive match, then Lithuanian/English keywords in the
+    category and description, and falls back to 'Kiti'.
+    """
+    category_lower = category.lower()
+    
+    # Try exact case-insensitive match
+    matched_category = CATEGORY_BY_LOWER.get(category_lower)
+    if matched_category:
+        return matched_category
+    
+    # Intelligent fallback with Lithuanian keywords
+    description_lower = description.lower()
+    matched_category = match_category_keywords(f"{category_lower} {description_lower}")
+    if matched_category:
+        return matched_category
+    
+    # Final fallback to 'Kiti'
+    logger.debug("Category fallback: '%s' (desc: %.30s) -> 'Kiti'", category, description_lower)
+    return 'Kiti'
+
+
+@app.route('/scan-receipt', methods=['POST'])
+def scan_receipt():
+    """
+    Route to scan receipt images using OpenAI Vision API (GPT-4o - best model).
+    Serverless version: processes files from memory only (no disk saving).
+    Includes image resizing for Vercel payload limits.
+    """
+    try:
+        logger.debug("--- STARTING SCAN ---")
         
-        # 2. Dictionary Search
-        elif isinstance(data, dict):
-            print("DEBUG: Data is a dictionary, searching for items...")
-            
-            common_keys = ['items', 'expenses', 'products', 'receipt_items']
-            found_key = None
-            
-            for key in common_keys:
-                if key in data:
-                    found_key = key
-                    items = data[key]
-                    print(f"DEBUG: Found items under key '{key}'")
-                    break
-            
-            # Fallback: iterate through ALL values
-            if items is None:
-                print("DEBUG: No common keys found, searching all dictionary values...")
-                for key, value in data.items():
-                    if isinstance(value, list):
-                        items = value
-                        print(f"DEBUG: Found list under key '{key}', using as items")
-                        break
-            
-            # Check if data itself might be a single item
-            if items is None:
-                print("DEBUG: No list found in dictionary, checking if data is a single item...")
-                required_fields = ['vendor', 'date', 'category']
-                has_amount = 'total_amount' in data or 'amount' in data
-                if all(key in data for key in required_fields) and has_amount:
-                    items = [data]
-                    print("DEBUG: Data appears to be a single item, wrapping in list")
+        # Check if file was uploaded
+        if 'file' not in request.files:
+            return jsonify({"error": "Nepateiktas failas"}), 400
         
-        # 3. Empty Fallback
-        if items is None:
-            print("DEBUG: No items found, returning empty list")
-            items = []
+        file_bytes, file_ext = read_receipt_upload(request.files['file'])
         
-        # 4. Ensure items is a list
-        if not isinstance(items, list):
-            print(f"DEBUG: Items is not a list (type: {type(items)}), converting...")
-            items = [items] if items else []
+        # Generate a unique filename for response (not saved to disk)
+        # (nanosecond clock: unique per request and needs no date formatting)
+        unique_filename = f"receipt_{time.time_ns()}.{file_ext}"
         
-        print(f"DEBUG: Final items count: {len(items)}")
+        # STEP 2: Preprocess; drop the raw upload before the slow API call.
+        # On a cold start the OpenAI client is created meanwhile.
+        start_openai_client_init()
+        image = prepare_receipt_image(file_bytes, file_ext)
+        file_bytes = None
         
-        # Validate and clean each item
-        validated_items = []
-        for item in items:
-            if not isinstance(item, dict):
-                continue
-                
-            required_keys = ['vendor', 'date', 'category']
-            has_amount = 'total_amount' in item or 'amount' in item
-            
-            if not all(key in item for key in required_keys) or not has_amount:
-                continue  # Skip invalid items
-            
-            # Normalize amount fields
-            if 'amount' in item and 'total_amount' not in item:
-                item['total_amount'] = item.pop('amount')
-            
-            # Convert total_amount if it's a string
-            if 'total_amount' in item:
-                if isinstance(item['total_amount'], str):
-                    amount_str = item['total_amount'].replace('€', '').replace('$', '').replace(',', '.').strip()
-                    try:
-                        item['total_amount'] = float(amount_str)
-                    except ValueError:
-                        continue  # Skip items with invalid amounts
-            
-            # Handle vat_amount
-            if 'vat_amount' not in item:
-                item['vat_amount'] = 0.0
-            elif isinstance(item['vat_amount'], str):
-                vat_str = item['vat_amount'].replace('€', '').replace('$', '').replace(',', '.').strip()
-                try:
-                    item['vat_amount'] = float(vat_str) if vat_str else 0.0
-                except ValueError:
-                    item['vat_amount'] = 0.0
-            
-            # Handle net_amount
-            if 'net_amount' not in item:
-                total = float(item.get('total_amount', 0))
-                vat = float(item.get('vat_amount', 0))
-                item['net_amount'] = total - vat
-            elif isinstance(item['net_amount'], str):
-                net_str = item['net_amount'].replace('€', '').replace('$', '').replace(',', '.').strip()
-                try:
-                    item['net_amount'] = float(net_str) if net_str else 0.0
-                except ValueError:
-                    total = float(item.get('total_amount', 0))
-                    vat = float(item.get('vat_amount', 0))
-                    item['net_amount'] = total - vat
-            
-            # STRICT Category Validation with Lithuanian keyword support
-            original_category = item.get('category', '').strip()
-            description_lower = item.get('description', '').lower()
-            
-            if original_category not in VALID_CATEGORIES:
-                category_lower = original_category.lower()
-                matched_category = None
-                
-                # Try exact case-insensitive match
-                for valid_cat in VALID_CATEGORIES:
-                    if valid_cat.lower() == category_lower:
-                        matched_category = valid_cat
-                        break
-                
-                # Intelligent fallback with Lithuanian keywords
-                if not matched_category:
-                    # Combined text for keyword matching
-                    search_text = f"{category_lower} {description_lower}"
-                    
-                    # Lithuanian food keywords
-                    food_keywords = [
-                        'maistas', 'food', 'grocer', 'restaurant', 'cafe', 'meal', 'snack',
-                        'duona', 'pienas', 'sviestas', 'kiaušin', 'mėsa', 'višt', 'kiaul', 'jautien',
-                        'žuvis', 'lašiš', 'sūris', 'varškė', 'grietin', 'jogurt', 'kefyr',
-                        'alus', 'vynas', 'sult', 'vanduo', 'kava', 'arbata', 'gėrim',
-                        'cukrus', 'druska', 'milt', 'ryži', 'makaron', 'bulv', 'mork',
-                        'svogūn', 'pomidor', 'agurk', 'obuol', 'banan', 'apelsin',
-                        'saldain', 'šokolad', 'led', 'pyrag', 'bandel', 'sumuštini',
-                        'maxima', 'iki', 'lidl', 'rimi', 'norfa', 'bread', 'milk', 'cheese',
-                        'kebab', 'pica', 'pizza', 'burger', 'kavin', 'restoran'
-                    ]
-                    
-                    # Lithuanian transport keywords
-                    transport_keywords = [
-                        'transportas', 'fuel', 'gas', 'parking', 'transport', 'car', 'taxi',
-                        'degalai', 'benzin', 'dyzel', 'diesel', 'parkav', 'plovykl',
-                        'tepal', 'aušin', 'circle k', 'viada', 'orlen', 'neste',
-                        'autoservis', 'autobus', 'traukin', 'taksi'
-                    ]
-                    
-                    # Lithuanian household chemicals keywords
-                    chemistry_keywords = [
-                        'buitin', 'chemij', 'detergent', 'soap', 'shampoo', 'washing', 'chemical', 'hygiene', 'household',
-                        'skalbim', 'plovikl', 'valikl', 'dezodorant', 'šampūn', 'muil',
-                        'dantų past', 'tualetinis popier', 'servetėl', 'kapsul', 'minkštikl',
-                        'balikl', 'higienos', 'wc', 'grindų'
-                    ]
-                    
-                    # Lithuanian office keywords
-                    office_keywords = [
-                        'office', 'stationery', 'paper', 'pen', 'printer', 'biuras',
-                        'popier', 'rašikl', 'sąsiuvin', 'segtuk', 'vokai', 'spausdint', 'rašal',
-                        'kanceliar'
-                    ]
-                    
-                    # Lithuanian utilities keywords
-                    utilities_keywords = [
-                        'utility', 'electric', 'water', 'internet', 'phone', 'komunalin',
-                        'elektr', 'vanden', 'duj', 'šildym', 'telefon', 'telia', 'tele2', 'bite'
-                    ]
-                    
-                    # Check keywords
-                    if any(kw in search_text for kw in food_keywords):
-                        matched_category = 'Maistas'
-                    elif any(kw in search_text for kw in transport_keywords):
-                        matched_category = 'Transportas'
-                    elif any(kw in search_text for kw in chemistry_keywords):
-                        matched_category = 'Buitinė chemija'
-                    elif any(kw in search_text for kw in office_keywords):
-                        matched_category = 'Biuras'
-                    elif any(kw in search_text for kw in utilities_keywords):
-                        matched_category = 'Komunaliniai'
-                    elif any(kw in search_text for kw in ['clean', 'valym', 'švara']):
-                        matched_category = 'Švara'
-                    elif any(kw in search_text for kw in ['rent', 'lease', 'nuom', 'būst']):
-                        matched_category = 'Nuoma'
-                    elif any(kw in search_text for kw in ['service', 'repair', 'paslaug', 'remont', 'konsult']):
-                        matched_category = 'Paslaugos'
-                
-                # Final fallback to 'Kiti'
-                if not matched_category:
-                    matched_category = 'Kiti'
-                    print(f"⚠ Category fallback: '{original_category}' (desc: {description_lower[:30]}) → 'Kiti'")
-                
-                item['category'] = matched_category
-            
-            # Map total_amount to amount for frontend compatibility
-            if 'total_amount' in item:
-                item['amount'] = item['total_amount']
-            
-            validated_items.append(item)
+        # STEP 3: Ask the model and validate what it returned
+        data = request_receipt_json(RECEIPT_USER_PROMPT, [image])
+        image = None
+        validated_items = extract_receipt_items(data)
         
         # Return data with filename and items (filename is just for reference, not a saved file)
         result = {
             "filename": unique_filename,
             "items": validated_items
         }
-        print(f"DEBUG: Returning {len(validated_items)} validated items")
-        print("--- SCAN COMPLETE ---")
+        logger.debug("Returning %d validated items", len(validated_items))
+        logger.debug("--- SCAN COMPLETE ---")
         return jsonify(result)
+    
+    except ReceiptScanError as e:
+        return jsonify({"error": e.message}), e.status
+    except Exception as e:
+        logger.exception("CRITICAL SERVER ERROR")
+        return jsonify({"error": f"Serverio klaida: {str(e)[:200]}"}), 500
+
+
+@app.route('/scan-receipts-batch', methods=['POST'])
+def scan_receipts_batch():
+    """
+    Scan several receipts with a single OpenAI request.
+    
+    Files are sent as repeated 'files' form fields. They are preprocessed in
+    parallel threads (Pillow releases the GIL while working on pixels) and
+    sent as separate images in one GPT-4o message, so the round-trip and the
+    system prompt are paid once per batch instead of once per receipt.
+    
+    Returns {"receipts": [{"filename", "items"}, ...]} in upload order.
+    """
+    try:
+        files = request.files.getlist('files')
+        if not files:
+            return jsonify({"error": "Nepateiktas failas"}), 400
+        if len(files) > MAX_BATCH_FILES:
+            return jsonify({"error": f"Per daug failų. Maksimalus skaičius: {MAX_BATCH_FILES}"}), 400
+        
+        uploads = [read_receipt_upload(file) for file in files]
+        file_exts = [file_ext for _, file_ext in uploads]
+        
+        start_openai_client_init()
+        with ThreadPoolExecutor(max_workers=min(4, len(uploads))) as executor:
+            images = list(executor.map(lambda upload: prepare_receipt_image(*upload), uploads))
+        uploads = None
+        
+        prompt = RECEIPT_USER_PROMPT + RECEIPT_BATCH_PROMPT.format(count=len(images))
+        # Output grows with the number of receipts; gpt-4o caps output at 16k
+        max_tokens = min(4000 * len(images), 16000)
+        data = request_receipt_json(prompt, images, max_tokens=max_tokens)
+        images = None
+        
+        receipts = data.get('receipts') if isinstance(data, dict) else data
+        if not isinstance(receipts, list):
+            receipts = []
         
+        timestamp = time.time_ns()
+        results = []
+        for index, file_ext in enumerate(file_exts):
+            receipt_data = receipts[index] if index < len(receipts) else None
+            results.append({
+                "filename": f"receipt_{timestamp}_{index + 1}.{file_ext}",
+                "items": extract_receipt_items(receipt_data)
+            })
+        
+        logger.debug("Returning %d scanned receipts", len(results))
+        return jsonify({"receipts": results})
+    
+    except ReceiptScanError as e:
+        return jsonify({"error": e.message}), e.status
     except Exception as e:
-        print("CRITICAL SERVER ERROR:")
-        print(traceback.format_exc())
+        logger.exception("CRITICAL SERVER ERROR")
         return jsonify({"error": f"Serverio klaida: {str(e)[:200]}"}), 500
 
 
+# Lithuanian letters -> ASCII for FPDF's built-in Helvetica (latin-1 only).
+# One str.translate pass instead of a replace() per character.
+PDF_TEXT_TRANSLATION = str.maketrans({
+    'ą': 'a', 'č': 'c', 'ę': 'e', 'ė': 'e', 'į': 'i',
+    'š': 's', 'ų': 'u', 'ū': 'u', 'ž': 'z',
+    'Ą': 'A', 'Č': 'C', 'Ę': 'E', 'Ė': 'E', 'Į': 'I',
+    'Š': 'S', 'Ų': 'U', 'Ū': 'U', 'Ž': 'Z',
+    '€': 'EUR'
+})
+
+@lru_cache(maxsize=4096)
+def safe_text(text):
+    """
+    Replace Lithuanian characters with ASCII equivalents for basic FPDF.
+
+    Cached because the same seller/client names and item descriptions come
+    back invoice after invoice; a hit is a dict lookup instead of a
+    translate() over the whole string.
+    """
+    if not text:
+        return ""
+    return text.translate(PDF_TEXT_TRANSLATION)
+
+
+# Invoice item table columns: (width in mm, text alignment)
+INVOICE_ITEM_COLUMNS = (
+    (55, "L"),  # Aprasymas
+    (18, "C"),  # Kiekis
+    (28, "R"),  # Kaina be PVM
+    (18, "C"),  # PVM %
+    (28, "R"),  # PVM suma
+    (28, "R"),  # Suma
+)
+
+
+# Alternating fill colors of invoice item rows (even, odd)
+INVOICE_ROW_FILLS = ((250, 250, 250), (255, 255, 255))
+
+
 @app.route('/api/generate-pdf', methods=['POST'])
 def generate_pdf():
     """
@@ -682,26 +1191,10 @@ def generate_pdf():
         # Import FPDF2 with Unicode support
         try:
             from fpdf import FPDF
+            from fpdf.enums import XPos, YPos
         except ImportError:
             return jsonify({"error": "PDF generatorius nepasiekiamas. Įdiekite fpdf2."}), 500
 
-        # Helper function to safely encode text
-        def safe_text(text):
-            """Replace Lithuanian characters with ASCII equivalents for basic FPDF"""
-            if not text:
-                return ""
-            replacements = {
-                'ą': 'a', 'č': 'c', 'ę': 'e', 'ė': 'e', 'į': 'i',
-                'š': 's', 'ų': 'u', 'ū': 'u', 'ž': 'z',
-                'Ą': 'A', 'Č': 'C', 'Ę': 'E', 'Ė': 'E', 'Į': 'I',
-                'Š': 'S', 'Ų': 'U', 'Ū': 'U', 'Ž': 'Z',
-                '€': 'EUR'
-            }
-            result = text
-            for lt_char, ascii_char in replacements.items():
-                result = result.replace(lt_char, ascii_char)
-            return result
-
         pdf = FPDF()
         pdf.add_page()
         pdf.set_auto_page_break(auto=True, margin=15)
@@ -791,39 +1284,59 @@ def generate_pdf():
         pdf.ln()
         pdf.set_text_color(0, 0, 0)
 
-        # Table rows
-        pdf.set_font("Helvetica", "", 9)
+        # Table rows: first compute totals and the text of every cell, then
+        # write the rows in one tight loop with the font set once
         calc_subtotal = 0.0
         calc_vat = 0.0
         calc_total = 0.0
+        rows = []
+        # The frontend normally sends all three totals; only sum the rows
+        # when at least one of them is missing
+        need_calc = not (subtotal > 0 and vat_total > 0 and grand_total > 0)
 
-        for i, item in enumerate(items):
-            desc = safe_text(str(item.get("description", ""))[:35])
-            qty = float(item.get("qty") or 0)
-            
-            net = float(item.get("net") or item.get("price") or 0)
-            vat_rate = float(item.get("vatRate") or 21)
-            vat_amount = float(item.get("vatAmount") or (net * qty * vat_rate / 100))
-            total = float(item.get("total") or (net * qty + vat_amount))
+        for item in items:
+            get = item.get
+            desc = get("description", "")
+            if not isinstance(desc, str):
+                desc = str(desc)
+            # Slice first so safe_text's cache is keyed on the printed part only
+            desc = safe_text(desc[:35])
+            qty = float(get("qty") or 0)
             
+            net = float(get("net") or get("price") or 0)
+            vat_rate = float(get("vatRate") or 21)
             line_net = net * qty
-            calc_subtotal += line_net
-            calc_vat += vat_amount
-            calc_total += total
+            vat_amount = float(get("vatAmount") or (line_net * vat_rate / 100))
+            total = float(get("total") or (line_net + vat_amount))
+            
+            if need_calc:
+                calc_subtotal += line_net
+                calc_vat += vat_amount
+                calc_total += total
+
+            rows.append((
+                desc,
+                f"{qty:.0f}",
+                f"{net:.2f} EUR",
+                f"{vat_rate:.0f}%",
+                f"{vat_amount:.2f} EUR",
+                f"{total:.2f} EUR",
+            ))
 
+        pdf.set_font("Helvetica", "", 9)
+        # Bound methods as locals: this loop runs once per cell of the table
+        cell, set_fill_color = pdf.cell, pdf.set_fill_color
+        last_width, last_align = INVOICE_ITEM_COLUMNS[-1]
+        for i, row in enumerate(rows):
             # Alternating row colors
-            if i % 2 == 0:
-                pdf.set_fill_color(250, 250, 250)
-            else:
-                pdf.set_fill_color(255, 255, 255)
+            set_fill_color(*INVOICE_ROW_FILLS[i & 1])
             
-            pdf.cell(55, 7, desc, border=1, fill=True)
-            pdf.cell(18, 7, f"{qty:.0f}", border=1, align="C", fill=True)
-            pdf.cell(28, 7, f"{net:.2f} EUR", border=1, align="R", fill=True)
-            pdf.cell(18, 7, f"{vat_rate:.0f}%", border=1, align="C", fill=True)
-            pdf.cell(28, 7, f"{vat_amount:.2f} EUR", border=1, align="R", fill=True)
-            pdf.cell(28, 7, f"{total:.2f} EUR", border=1, align="R", fill=True)
-            pdf.ln()
+            for (width, align), text in zip(INVOICE_ITEM_COLUMNS[:-1], row):
+                cell(width, 7, text, border=1, align=align, fill=True)
+            # The last cell moves to the start of the next row itself,
+            # which saves a separate pdf.ln() call per row
+            cell(last_width, 7, row[-1], border=1, align=last_align, fill=True,
+                 new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
         # Use provided totals or calculated ones
         final_subtotal = subtotal if subtotal > 0 else calc_subtotal
@@ -858,22 +1371,30 @@ def generate_pdf():
         pdf.set_font("Helvetica", "", 8)
         pdf.cell(0, 5, f"Saskaita sugeneruota: {date_str}", ln=True, align="C")
 
-        # Output to bytes
+        # Output to bytes - fpdf2 already returns a bytearray, so hand it
+        # to the response as-is instead of copying it into a BytesIO and
+        # letting send_file re-read it in chunks.
         pdf_bytes = pdf.output()
-        buffer = io.BytesIO(pdf_bytes)
-        buffer.seek(0)
 
         filename = f"{invoice_series}-{invoice_number}.pdf"
-        return send_file(
-            buffer,
-            mimetype="application/pdf",
-            as_attachment=True,
-            download_name=filename,
-        )
+        response = Response(pdf_bytes, mimetype="application/pdf")
+        # Same Content-Disposition as send_file(download_name=...): non-ASCII
+        # names get an ASCII fallback plus an RFC 5987 filename* parameter,
+        # and headers.set() quotes/escapes the values (e.g. a '"' typed into
+        # the invoice number)
+        try:
+            filename.encode("ascii")
+        except UnicodeEncodeError:
+            simple = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+            quoted = quote(filename, safe="!#$&+-.^_`|~")
+            names = {"filename": simple, "filename*": f"UTF-8''{quoted}"}
+        else:
+            names = {"filename": filename}
+        response.headers.set("Content-Disposition", "attachment", **names)
+        return response
 
     except Exception as e:
-        print("PDF GENERATION ERROR:")
-        print(traceback.format_exc())
+        logger.exception("PDF GENERATION ERROR")
         return jsonify({"error": str(e)}), 500
 
 
@@ -882,6 +1403,7 @@ def generate_pdf():
 
 # For local development
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # PORT leidžia launcher'iui nurodyti, ant kurio porto paleisti serverį
+    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
 
 # Vercel Force Update: v2.1 - Better error handling and image resize
@@ -13,10 +13,15 @@ from tkinter import messagebox
 import subprocess
 import webbrowser
 import threading
-import time
 import os
 import sys
 import socket
+from pathlib import Path
+
+# Failas su paskutinio paleisto serverio portu. Jį rašo start.py
+# (PORT_CACHE_FILE) ir šis launcher'is, todėl pagal jį galima rasti jau
+# veikiantį serverį - fiksuoto porto nebėra, portą parenka sistema
+SERVER_PORT_FILE = Path(os.path.expanduser('~/.cache/laimis/port'))
 
 class FlaskLauncher:
     def __init__(self, root):
@@ -84,33 +89,53 @@ class FlaskLauncher:
         )
         self.browser_button.pack(pady=5)
     
-    def find_free_port(self, start_port=3000, max_attempts=100):
-        """Randa laisvą portą."""
-        for port in range(start_port, start_port + max_attempts):
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.bind(('127.0.0.1', port))
-                    return port
-            except OSError:
-                continue
-        return start_port
+    def find_free_port(self):
+        """Randa laisvą portą - leidžia OS jį parinkti (bind į portą 0)."""
+        # Vienas bind() vietoje iki 100 bandymų iš eilės nuo 3000
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(('127.0.0.1', 0))
+            return s.getsockname()[1]
     
-    def check_server_status(self):
-        """Tikrina, ar serveris veikia - bando rasti ant kurio porto."""
-        # Bandoma rasti serverį ant įvairių portų
-        for port in range(3000, 3100):
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def is_port_open(self, port):
+        """Patikrina, ar ant porto kas nors klauso (vienas connect bandymas)."""
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
                 sock.settimeout(0.1)
-                result = sock.connect_ex(('localhost', port))
-                sock.close()
-                if result == 0:
-                    self.is_running = True
-                    self.server_port = port
-                    self.update_ui_running()
-                    return
-            except:
-                pass
+                return sock.connect_ex(('127.0.0.1', port)) == 0
+        except OSError:
+            return False
+    
+    def read_recorded_port(self):
+        """Grąžina portą iš SERVER_PORT_FILE arba None, jei jo nėra ar jis sugadintas."""
+        try:
+            port = int(SERVER_PORT_FILE.read_text().strip())
+        except (OSError, ValueError):
+            return None
+        return port if 0 < port < 65536 else None
+    
+    def record_port(self, port):
+        """Įrašo portą į SERVER_PORT_FILE (nepavykus - tiesiog tęsiame be jo)."""
+        try:
+            os.makedirs(SERVER_PORT_FILE.parent, exist_ok=True)
+            SERVER_PORT_FILE.write_text(str(port))
+        except OSError:
+            pass
+    
+    def check_server_status(self):
+        """Tikrina, ar serveris jau veikia ant paskutinio įrašyto porto."""
+        # Anksčiau buvo skenuojami portai 3000-3099 (iki 10 s blokavimo).
+        # Portą įrašo start.py ir šis launcher'is, todėl pakanka patikrinti vieną.
+        port = self.read_recorded_port()
+        if port is not None and self.is_port_open(port):
+            self.is_running = True
+            self.server_port = port
+            self.update_ui_running()
+            # Šį serverį paleido ne launcher'is (pvz. start.py), todėl jo
+            # proceso neturime ir sustabdyti negalime - sustabdymo mygtukas
+            # išjungiamas, o naršyklėje atidaryti vis tiek galima
+            self.status_label.config(text="✓ Serveris jau veikia (paleistas ne čia)")
+            self.run_button.config(state="disabled")
+            return
         self.is_running = False
         self.server_port = None
         self.update_ui_stopped()
@@ -132,99 +157,82 @@ class FlaskLauncher:
             script_dir = os.path.dirname(os.path.abspath(__file__))
             os.chdir(script_dir)
             
+            # Portą parenkame patys ir perduodame app.py per PORT kintamąjį,
+            # kad nereikėtų vėliau jo ieškoti skenuojant portus
+            port = self.find_free_port()
+            env = dict(os.environ, PORT=str(port))
+            
+            # Įrašome portą, kad kitas launcher'io paleidimas rastų šį serverį
+            self.record_port(port)
+            
             # Paleisti Flask serverį fone
             self.server_process = subprocess.Popen(
                 [sys.executable, "app.py"],
+                env=env,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
             )
             
-            # Laukti, kol serveris pasileis
+            # Laukti, kol serveris pasileis. Tikrinama per root.after(), kad
+            # Tk langas neužšaltų (anksčiau time.sleep blokavo iki 10 s)
             self.status_label.config(text="Paleidžiama...", fg="orange")
-            self.root.update()
-            
-            # Patikrinti, ar serveris pasileido - rasti ant kurio porto
-            for i in range(20):
-                time.sleep(0.5)
-                # Bandoma rasti serverį ant įvairių portų
-                for port in range(3000, 3100):
-                    try:
-                        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        sock.settimeout(0.1)
-                        result = sock.connect_ex(('localhost', port))
-                        sock.close()
-                        if result == 0:
-                            self.is_running = True
-                            self.server_port = port
-                            self.update_ui_running()
-                            messagebox.showinfo("Sėkmė!", f"Serveris sėkmingai paleistas!\n\nAtidarykite naršyklėje:\nhttp://localhost:{port}")
-                            return
-                    except:
-                        pass
-            
-            # Jei nepasileido
-            self.is_running = False
-            self.update_ui_stopped()
-            messagebox.showerror("Klaida", "Nepavyko paleisti serverio.\nPatikrinkite, ar yra klaidų.")
+            self.run_button.config(state="disabled")
+            self.root.after(500, self.poll_server_ready, port)
             
         except Exception as e:
             messagebox.showerror("Klaida", f"Nepavyko paleisti serverio:\n{str(e)}")
             self.is_running = False
             self.update_ui_stopped()
     
+    def poll_server_ready(self, port, attempts=1):
+        """Vieną kartą patikrina, ar serveris jau klauso; jei ne - suplanuoja kitą patikrinimą."""
+        if self.is_port_open(port):
+            self.is_running = True
+            self.server_port = port
+            self.run_button.config(state="normal")
+            self.update_ui_running()
+            messagebox.showinfo("Sėkmė!", f"Serveris sėkmingai paleistas!\n\nAtidarykite naršyklėje:\nhttp://localhost:{port}")
+            return
+        
+        if attempts < 20:
+            self.root.after(500, self.poll_server_ready, port, attempts + 1)
+            return
+        
+        # Jei nepasileido per ~10 s
+        self.is_running = False
+        self.run_button.config(state="normal")
+        self.update_ui_stopped()
+        messagebox.showerror("Klaida", "Nepavyko paleisti serverio.\nPatikrinkite, ar yra klaidų.")
+    
     def stop_server(self):
         """Sustabdo Flask serverį."""
-        if not self.is_running:
+        # Stabdyti galime tik savo paleistą procesą
+        if not self.is_running or self.server_process is None:
             return
         
+        # Launcher'is pats paleido procesą, todėl užtenka jį sustabdyti
+        # tiesiogiai - nereikia ieškoti PID per `lsof` ir leisti papildomų
+        # `kill` procesų. terminate() veikia ir Windows, ir Mac/Linux.
         try:
-            # Rasti ir sustabdyti procesą, kuris naudoja rastą portą (Mac/Linux)
-            if self.server_port:
-                result = subprocess.run(
-                    ["lsof", f"-ti:{self.server_port}"],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
-                if result.stdout.strip():
-                    pid = result.stdout.strip()
-                    subprocess.run(["kill", "-9", pid], 
-                                 stdout=subprocess.PIPE, 
-                                 stderr=subprocess.PIPE)
-            # Taip pat sustabdyti pagal procesą
-            if self.server_process:
-                try:
-                    self.server_process.terminate()
-                    self.server_process.wait(timeout=5)
-                except:
-                    try:
-                        self.server_process.kill()
-                    except:
-                        pass
-        except:
-            pass
-        
-        if self.server_process:
+            self.server_process.terminate()
+            self.server_process.wait(timeout=5)
+        except Exception:
             try:
-                self.server_process.terminate()
-                self.server_process.wait(timeout=5)
-            except:
-                try:
-                    self.server_process.kill()
-                except:
-                    pass
+                self.server_process.kill()
+            except Exception:
+                pass
         
+        self.server_process = None
         self.is_running = False
         self.update_ui_stopped()
         messagebox.showinfo("Sustabdyta", "Serveris sustabdytas.")
     
     def open_browser(self):
         """Atidaro naršyklėje."""
+        # Mygtukas aktyvus tik kai serveris veikia, todėl portas visada žinomas
         if self.server_port:
             webbrowser.open(f"http://localhost:{self.server_port}")
-        else:
-            webbrowser.open("http://localhost:3000")  # Default
     
     def update_ui_running(self):
         """Atnaujina UI, kai serveris veikia."""
@@ -239,8 +247,8 @@ class FlaskLauncher:
         self.browser_button.config(state="disabled")
     
     def on_closing(self):
-        """Uždaryti langą - sustabdo serverį."""
-        if self.is_running:
+        """Uždaryti langą - sustabdo serverį (jei jį paleido launcher'is)."""
+        if self.is_running and self.server_process is not None:
             if messagebox.askokcancel("Uždaryti", "Ar tikrai norite uždaryti? Serveris bus sustabdytas."):
                 self.stop_server()
                 self.root.destroy()
@@ -7,13 +7,74 @@ in Python without writing raw SQL queries. This makes the code more readable and
 """
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, inspect, select, text
+from sqlalchemy.orm import Session, lazyload, object_session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.hybrid import hybrid_property
 from datetime import datetime
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
+
+# Money is rounded to whole cents
+TWOPLACES = Decimal('0.01')
+
+
+def to_decimal(value):
+    """
+    Return value as a Decimal.
+    
+    Numeric columns already come back from the database as Decimal, so those
+    are returned as-is; anything else (a float assigned in Python, or a float
+    SQL result on SQLite) goes through str() so 1.1 becomes Decimal('1.1')
+    rather than Decimal('1.100000000000000088817841970012523233890533447265625').
+    """
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def sum_item_totals(items):
+    """
+    Sum invoice items into (subtotal, vat_total), each rounded to cents.
+    
+    items yields (quantity, unit_price, vat_rate) for every item - taken from
+    loaded InvoiceItem objects or straight from a SELECT of those columns.
+    The sums are exact Decimals, rounded once with ROUND_HALF_UP at the end,
+    so the stored invoice totals and calculate_totals_breakdown() computed
+    from the same items always agree to the cent.
+    """
+    subtotal = Decimal('0')
+    vat_total = Decimal('0')
+    for quantity, unit_price, vat_rate in items:
+        # Item subtotal (quantity * unit_price) without VAT
+        item_subtotal = to_decimal(quantity) * to_decimal(unit_price)
+        subtotal += item_subtotal
+        # Item VAT amount (vat_rate is an Integer column, Decimal * int stays exact)
+        vat_total += item_subtotal * vat_rate / 100
+    return (subtotal.quantize(TWOPLACES, rounding=ROUND_HALF_UP),
+            vat_total.quantize(TWOPLACES, rounding=ROUND_HALF_UP))
+
+
+# Default create_engine() options for the database engine
+# - query_cache_size: SQLAlchemy caches compiled SQL for repeated queries; the
+#   default of 500 entries is raised so the handful of queries every request
+#   runs don't get evicted and recompiled
+# - pool_pre_ping: test a pooled connection before use, so a connection dropped
+#   by the database server is replaced instead of failing the request
+# - pool_recycle: reopen connections older than 30 minutes (servers like MySQL
+#   close idle connections on their own)
+# pool_size/max_overflow are left at their defaults on purpose: the in-memory
+# SQLite database used by the tests runs on StaticPool, which rejects them.
+# An app can still set them through SQLALCHEMY_ENGINE_OPTIONS for its database.
+ENGINE_OPTIONS = {
+    'query_cache_size': 1200,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+}
 
 # We create a db instance here that will be initialized in the Flask app
 # This is a common pattern - we define the db object here so models can import it
 # without creating circular imports
-db = SQLAlchemy()
+db = SQLAlchemy(engine_options=ENGINE_OPTIONS)
 
 
 class Client(db.Model):
@@ -70,10 +131,12 @@ class Client(db.Model):
     # Relationship: one client can have many invoices
     # This creates a virtual column that lets us access all invoices for a client
     # like: client.invoices (returns list of Invoice objects)
-    # backref creates a reverse relationship: invoice.client (returns Client object)
-    # lazy='dynamic' means we get a query object instead of loading all invoices at once
-    # This is better for performance when clients have many invoices
-    invoices = db.relationship('Invoice', backref='client', lazy='dynamic', cascade='all, delete-orphan')
+    # back_populates links it to Invoice.client, the reverse side (returns Client object)
+    # lazy='select' loads the invoices as a plain list on first access (one query).
+    # We used lazy='dynamic' before, but that returns a query object which runs
+    # SQL again on every .count()/.all() and can't be eager-loaded with
+    # selectinload()/joinedload() in list views
+    invoices = db.relationship('Invoice', back_populates='client', lazy='select', cascade='all, delete-orphan')
     
     def __repr__(self):
         """
@@ -120,6 +183,21 @@ class Invoice(db.Model):
     
     __tablename__ = 'invoices'
     
+    # Indexes for the columns invoice lists filter and sort by
+    # - (client_id, status): "invoices of this client", optionally by status;
+    #   also serves plain client_id lookups (the foreign key itself is not indexed)
+    # - invoice_date: date ranges and newest-first ordering
+    # - ix_invoices_unpaid: partial index holding only unpaid invoices, so
+    #   "what is still owed / overdue" never touches paid ones
+    #   (PostgreSQL and SQLite support partial indexes; others get a plain index)
+    __table_args__ = (
+        db.Index('ix_invoices_client_status', 'client_id', 'status'),
+        db.Index('ix_invoices_invoice_date', 'invoice_date'),
+        db.Index('ix_invoices_unpaid', 'due_date',
+                 postgresql_where=text("status != 'paid'"),
+                 sqlite_where=text("status != 'paid'")),
+    )
+    
     # Primary key: unique identifier for each invoice
     id = db.Column(db.Integer, primary_key=True)
     
@@ -138,8 +216,11 @@ class Invoice(db.Model):
     
     # Invoice date - when the invoice was issued
     # We use Date (not DateTime) because we typically only care about the day
-    # default=datetime.utcnow.date() sets today's date as default
-    invoice_date = db.Column(db.Date, default=datetime.utcnow().date, nullable=False)
+    # server_default=func.current_date() lets the database fill in today's date
+    # when the row is inserted. (The old default=datetime.utcnow().date was a
+    # method of a datetime created once at import, so every invoice got the date
+    # the app was started on.)
+    invoice_date = db.Column(db.Date, server_default=func.current_date(), nullable=False)
     
     # Due date - when payment is expected
     # This helps track which invoices are overdue
@@ -161,10 +242,18 @@ class Invoice(db.Model):
     notes = db.Column(db.Text, nullable=True)
     
     # Total amount - stored amount for the invoice
-    # We use Float to store the invoice total amount
-    # nullable=False means every invoice must have an amount (defaults to 0.0)
-    # default=0.0 ensures new invoices start with zero amount
-    amount = db.Column(db.Float, nullable=False, default=0.0)
+    # We use Numeric(12, 2) like every other money column, so it is stored exactly
+    # and comes back as Decimal (no float rounding, no float/Decimal conversions)
+    # nullable=False means every invoice must have an amount (defaults to 0)
+    # default=0 ensures new invoices start with zero amount
+    amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    
+    # Stored totals - sum of all items without VAT and sum of their VAT
+    # These are kept up to date by the InvoiceItem flush events at the bottom
+    # of this module, so when an invoice is loaded without its items, reading
+    # the total is a column read instead of loading and walking every item
+    subtotal = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    vat_total = db.Column(db.Numeric(12, 2), nullable=False, default=0)
     
     # Timestamp when invoice was created in the system
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -174,7 +263,7 @@ class Invoice(db.Model):
     #
     # The Invoice model has a relationship to Client through:
     # 1. Foreign Key: client_id (line 136) - stores the ID number
-    # 2. Relationship: Created via backref in Client model
+    # 2. Relationship: client (defined below), paired with Client.invoices
     #
     # HOW db.relationship WORKS:
     # ========================
@@ -182,27 +271,31 @@ class Invoice(db.Model):
     # db.relationship() creates a Python property that lets you access related objects
     # without writing SQL JOIN queries manually.
     #
-    # In the Client model (line 75), we have:
-    #   invoices = db.relationship('Invoice', backref='client', ...)
+    # The two sides are defined explicitly, one in each model:
+    #   Client:  invoices = db.relationship('Invoice', back_populates='client', ...)
+    #   Invoice: client = db.relationship('Client', back_populates='invoices')
     #
-    # This creates TWO relationships:
+    # This gives us TWO relationships:
     #
     # 1. client.invoices - Access all invoices for a client
     #    Example: client = Client.query.get(1)
-    #             all_invoices = client.invoices.all()  # Gets all invoices for this client
+    #             all_invoices = client.invoices  # List of all invoices for this client
     #
-    # 2. invoice.client - Access the client for an invoice (via backref)
+    # 2. invoice.client - Access the client for an invoice
     #    Example: invoice = Invoice.query.get(1)
     #             client = invoice.client  # Gets the Client object linked to this invoice
     #             client_name = invoice.client.name  # Access client's name
     #
-    # WHAT backref DOES:
-    # ================
+    # WHAT back_populates DOES:
+    # ========================
     #
-    # backref='client' automatically creates a reverse relationship.
-    # - We define the relationship in Client model: invoices = db.relationship(...)
-    # - backref creates the opposite: invoice.client (without defining it in Invoice model)
-    # - This is convenient - we only define it once, get both directions
+    # back_populates tells SQLAlchemy the two attributes are the same link seen
+    # from both ends, and keeps them in sync in Python:
+    # - invoice.client = some_client also adds invoice to some_client.invoices
+    # - Unlike the older backref=, both sides are visible in their own model, so
+    #   each side can get its own loading options and readers can find them
+    # - How related rows are loaded is then chosen per query where needed, e.g.
+    #   select(Invoice).options(joinedload(Invoice.client), selectinload(Invoice.items))
     #
     # WITHOUT relationship (manual way):
     #   invoice = Invoice.query.get(1)
@@ -218,43 +311,59 @@ class Invoice(db.Model):
     # - Automatic: SQLAlchemy handles the SQL JOIN for you
     # - Efficient: Can be optimized with lazy loading
     # - Type-safe: Your IDE knows invoice.client is a Client object
+    # lazy='selectin': to_dict() always shows the client name, so the clients of
+    # all invoices in a query result are loaded together with one
+    # SELECT ... WHERE id IN (...) instead of one query per invoice
+    client = db.relationship('Client', back_populates='invoices', lazy='selectin')
     
     # Relationship: one invoice can have many items
     # This lets us access invoice.items to get all items on this invoice
     # cascade='all, delete-orphan' means if invoice is deleted, items are deleted too
     # order_by sorts items by id (so they appear in creation order)
-    items = db.relationship('InvoiceItem', backref='invoice', lazy='dynamic', 
+    # lazy='selectin' loads the items of all invoices returned by a query with
+    # one extra SELECT ... WHERE invoice_id IN (...), instead of one query per
+    # invoice (the N+1 problem); invoice.items is then a plain list
+    # back_populates pairs it with InvoiceItem.invoice
+    items = db.relationship('InvoiceItem', back_populates='invoice', lazy='selectin', 
                            cascade='all, delete-orphan', order_by='InvoiceItem.id')
     
     def __repr__(self):
         """String representation for debugging."""
         return f'<Invoice {self.invoice_number}>'
     
+    def has_unflushed_item_changes(self):
+        """
+        Check whether the session holds item changes for this invoice that
+        are not flushed yet (new, modified or deleted items, or items moved
+        to or from this invoice). The stored totals don't include those yet.
+        """
+        session = object_session(self)
+        if session is None:
+            return False
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            if not isinstance(obj, InvoiceItem):
+                continue
+            state = inspect(obj)
+            # state.dict holds only what is already in memory, so checking it
+            # never triggers a lazy load
+            if state.dict.get('invoice') is self:
+                return True
+            if self.id is not None and (
+                    obj.invoice_id == self.id
+                    or self.id in state.attrs.invoice_id.history.deleted):
+                return True
+        return False
+    
     def calculate_total(self):
         """
         Calculate GRAND TOTAL amount for this invoice (including VAT).
         
-        We calculate this dynamically (not stored in database) because:
-        1. It's always accurate - if items change, total updates automatically
-        2. Reduces data duplication (single source of truth)
-        3. Prevents inconsistencies if someone manually edits the database
+        Uses calculate_totals_breakdown(), which sums the loaded (or changed)
+        items, or else reads the stored subtotal and vat_total columns.
         
         Returns the sum of all item totals including VAT (grand total).
-        
-        NOTE: We use Decimal for calculations because unit_price is stored as
-        Numeric(10, 2) which returns Decimal type. We need to convert quantity
-        to Decimal before multiplying to avoid TypeError.
-        """
-        # Initialize total as Decimal(0) for precise calculations
-        total = Decimal('0')
-        # We iterate through all items and sum their totals with VAT
-        # Each item calculates: (quantity * unit_price) + vat_amount
-        for item in self.items:
-            # Use the total_with_vat property which handles all Decimal conversions
-            item_total = Decimal(str(item.total_with_vat))
-            total += item_total
-        # Convert back to float for return value (maintains compatibility)
-        return float(total)
+        """
+        return self.calculate_totals_breakdown()['grand_total']
     
     def calculate_totals_breakdown(self):
         """
@@ -265,8 +374,12 @@ class Invoice(db.Model):
         - vat_total: Sum of all VAT amounts
         - grand_total: Sum of all items with VAT (subtotal + vat_total)
         
-        All calculations use Decimal for precision to avoid floating point errors.
-        This is critical for financial calculations where precision matters.
+        If the items are already loaded (the usual case with lazy='selectin'),
+        the invoice has not been flushed yet, or some item changes are not
+        flushed yet, they are summed in Python with Decimal. Otherwise the
+        stored subtotal and vat_total columns are used, so the items never
+        have to be loaded. The stored columns are computed by the same
+        sum_item_totals() helper, so both ways give the same cents.
         
         Returns:
             dict: {
@@ -275,22 +388,19 @@ class Invoice(db.Model):
                 'grand_total': float
             }
         """
-        # Initialize all totals as Decimal(0) for precise calculations
-        subtotal = Decimal('0')
-        vat_total = Decimal('0')
-        
-        # Iterate through all items and calculate subtotals and VAT
-        for item in self.items:
-            # Calculate item subtotal (quantity * unit_price) without VAT
-            quantity_decimal = Decimal(str(item.quantity))
-            unit_price_decimal = Decimal(str(item.unit_price)) if not isinstance(item.unit_price, Decimal) else item.unit_price
-            item_subtotal = quantity_decimal * unit_price_decimal
-            subtotal += item_subtotal
-            
-            # Calculate item VAT amount
-            vat_rate_decimal = Decimal(str(item.vat_rate))
-            item_vat = (item_subtotal * vat_rate_decimal) / Decimal('100')
-            vat_total += item_vat
+        if (self.id is None or 'items' not in inspect(self).unloaded
+                or self.has_unflushed_item_changes()):
+            # Items are already in memory (loaded via selectin, or the invoice
+            # is not flushed yet and has no id to filter on) - summing them in
+            # Python is cheaper than another round-trip to the database.
+            # Items changed but not flushed yet are only correct in memory too
+            subtotal, vat_total = sum_item_totals(
+                (item.quantity, item.unit_price, item.vat_rate) for item in self.items)
+        else:
+            # Items are not loaded and nothing about them is pending: the
+            # stored totals are up to date, so no items have to be loaded
+            subtotal = self.subtotal
+            vat_total = self.vat_total
         
         # Calculate grand total (subtotal + VAT)
         grand_total = subtotal + vat_total
@@ -302,13 +412,51 @@ class Invoice(db.Model):
             'grand_total': float(grand_total)
         }
     
-    def to_dict(self):
+    @classmethod
+    def list_with_totals(cls):
+        """
+        Load all invoices together with their totals and item counts in one query.
+        
+        The totals come from the stored subtotal and vat_total columns and the
+        item count from a JOIN + GROUP BY, so a list page needs neither the
+        items themselves nor a per-invoice loop over them: items are not
+        loaded at all (lazyload overrides the default selectin), and clients
+        come in with one extra SELECT ... IN (...).
+        
+        Returns:
+            list of (Invoice, subtotal, vat_total, grand_total, items_count)
+            tuples with the totals as floats; pass grand_total and items_count
+            on to to_dict(total=..., items_count=...)
+        """
+        rows = db.session.execute(
+            select(cls, func.count(InvoiceItem.id))
+            .outerjoin(InvoiceItem, InvoiceItem.invoice_id == cls.id)
+            .group_by(cls.id)
+            .order_by(cls.id)
+            .options(lazyload(cls.items), selectinload(cls.client))
+        ).all()
+        result = []
+        for invoice, items_count in rows:
+            # Same values calculate_totals_breakdown() reads for an invoice
+            # without loaded items (rounded by sum_item_totals() when stored)
+            subtotal = invoice.subtotal
+            vat_total = invoice.vat_total
+            result.append((invoice, float(subtotal), float(vat_total), float(subtotal + vat_total), items_count))
+        return result
+    
+    def to_dict(self, total=None, items_count=None):
         """
         Convert Invoice object to dictionary with calculated total.
         
         We include the calculated total so frontend/API consumers
-        don't need to calculate it themselves.
+        don't need to calculate it themselves. Callers that already have the
+        total and item count (e.g. from list_with_totals()) can pass them in
+        so nothing is recalculated or loaded.
         """
+        if total is None:
+            total = self.calculate_total()
+        if items_count is None:
+            items_count = len(self.items)
         return {
             'id': self.id,
             'invoice_number': self.invoice_number,
@@ -320,8 +468,8 @@ class Invoice(db.Model):
             'status': self.status,
             'notes': self.notes,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'total': self.calculate_total(),  # Include calculated total
-            'items_count': self.items.count()  # Number of items for quick reference
+            'total': total,  # Include calculated total
+            'items_count': items_count  # Number of items for quick reference
         }
 
 
@@ -351,16 +499,20 @@ class InvoiceItem(db.Model):
     # ondelete='CASCADE' means if invoice is deleted, items are deleted too
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False)
     
+    # Relationship back to the invoice (reverse side of Invoice.items)
+    invoice = db.relationship('Invoice', back_populates='items')
+    
     # Description of the service or product
     # This is what appears on the invoice line item
     # nullable=False because every item needs a description
     description = db.Column(db.String(200), nullable=False)
     
     # Quantity - how many units of this item
-    # We use Float instead of Integer because quantities can be fractional
-    # (e.g., 2.5 hours of work, 0.5 months of service)
-    # nullable=False with default=1.0 means if not specified, assume 1 unit
-    quantity = db.Column(db.Float, nullable=False, default=1.0)
+    # We use Numeric(10, 3) instead of Integer because quantities can be fractional
+    # (e.g., 2.5 hours of work, 0.5 months of service). Like unit_price it comes
+    # back from the database as Decimal, so quantity * unit_price needs no conversion
+    # nullable=False with default=1 means if not specified, assume 1 unit
+    quantity = db.Column(db.Numeric(10, 3), nullable=False, default=1)
     
     # Unit price - price per unit
     # We use Numeric(10, 2) which stores exactly 2 decimal places
@@ -370,9 +522,10 @@ class InvoiceItem(db.Model):
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
     
     # Optional: tax rate for this item (e.g., 21 for 21% VAT)
-    # We store as Float to allow decimal percentages if needed
+    # We store as Numeric(5, 2) to allow decimal percentages if needed (e.g. 5.5)
+    # and to keep tax calculations in Decimal together with unit_price
     # nullable=True because some items might be tax-exempt
-    tax_rate = db.Column(db.Float, nullable=True, default=0.0)
+    tax_rate = db.Column(db.Numeric(5, 2), nullable=True, default=0)
     
     # VAT rate (PVM) for this item - standard Lithuanian VAT is 21%
     # We use Integer because VAT rates are typically whole numbers (0, 5, 9, 21)
@@ -383,9 +536,9 @@ class InvoiceItem(db.Model):
     # Discount percentage for this item
     # Represents a percentage discount (e.g., 10 means 10% off)
     # Default is 0 (no discount)
-    # We use Float to allow decimal discounts if needed (e.g., 5.5%)
-    # nullable=False with default=0.0 means every item has no discount unless explicitly set
-    discount = db.Column(db.Float, nullable=False, default=0.0)
+    # We use Numeric(5, 2) to allow decimal discounts if needed (e.g., 5.5%)
+    # nullable=False with default=0 means every item has no discount unless explicitly set
+    discount = db.Column(db.Numeric(5, 2), nullable=False, default=0)
     
     # Timestamp when item was added
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -394,6 +547,43 @@ class InvoiceItem(db.Model):
         """String representation for debugging."""
         return f'<InvoiceItem {self.description}>'
     
+    @classmethod
+    def bulk_create(cls, invoice_id, items_data):
+        """
+        Insert many items of one invoice at once.
+        
+        db.session.add() per item runs the full unit of work for every row
+        (identity map, events, one INSERT each). bulk_insert_mappings() skips
+        all of that and sends the rows as a single executemany INSERT, which is
+        much faster for invoices with many lines.
+        
+        Because the bulk insert skips the item events, the invoice's stored
+        totals are recomputed explicitly afterwards. The caller commits.
+        
+        Args:
+            invoice_id: id of the (already flushed) invoice the items belong to
+            items_data: list of dicts with InvoiceItem column values
+                        (description, quantity, unit_price, vat_rate, ...)
+        """
+        columns = cls.__table__.columns.keys()
+        mappings = []
+        for data in items_data:
+            # Keep only real columns and always attach the item to this invoice
+            mapping = {key: value for key, value in data.items() if key in columns and key != 'id'}
+            mapping['invoice_id'] = invoice_id
+            mappings.append(mapping)
+        
+        if not mappings:
+            return
+        
+        db.session.bulk_insert_mappings(cls, mappings)
+        refresh_invoice_totals(db.session, [invoice_id])
+        
+        # An already loaded invoice.items list doesn't know about the new rows
+        invoice = db.session.identity_map.get(db.session.identity_key(Invoice, invoice_id))
+        if invoice is not None:
+            db.session.expire(invoice, ['items'])
+    
     def calculate_subtotal(self):
         """
         Calculate subtotal for this item (quantity * unit_price).
@@ -404,17 +594,19 @@ class InvoiceItem(db.Model):
         3. Simple calculation, no need to store redundant data
         
         Returns the subtotal before tax.
+        """
+        return float(self.subtotal_decimal())
+    
+    def subtotal_decimal(self):
+        """
+        Subtotal for this item (quantity * unit_price) as a Decimal.
         
-        NOTE: We use Decimal for calculations because unit_price is stored as
-        Numeric(10, 2) which returns Decimal type. We need to convert quantity
-        to Decimal before multiplying to avoid TypeError.
+        Shared by calculate_subtotal, vat_amount, total_with_vat and the invoice
+        breakdown. Both columns are Numeric, so values loaded from the database
+        are already Decimal and are multiplied directly; only values assigned in
+        Python but not yet flushed (e.g. a float quantity) need converting.
         """
-        # Convert both quantity and unit_price to Decimal before multiplying
-        # This prevents TypeError: unsupported operand type(s) for *: 'float' and 'decimal.Decimal'
-        quantity_decimal = Decimal(str(self.quantity))
-        unit_price_decimal = Decimal(str(self.unit_price)) if not isinstance(self.unit_price, Decimal) else self.unit_price
-        subtotal = quantity_decimal * unit_price_decimal
-        return float(subtotal)
+        return to_decimal(self.quantity) * to_decimal(self.unit_price)
     
     def calculate_total_with_tax(self):
         """
@@ -425,13 +617,35 @@ class InvoiceItem(db.Model):
         
         Returns the total including tax.
         """
-        subtotal = self.calculate_subtotal()
+        subtotal = self.subtotal_decimal()
         if self.tax_rate:
-            tax_amount = subtotal * (self.tax_rate / 100.0)
-            return subtotal + tax_amount
-        return subtotal
+            subtotal += subtotal * to_decimal(self.tax_rate) / 100
+        return float(subtotal)
+    
+    # HYBRID PROPERTIES:
+    # =================
+    #
+    # subtotal, vat_amount and total_with_vat are @hybrid_property: on an item
+    # they compute a float in Python (with Decimal inside), while on the class
+    # they turn into a SQL expression. So the same name works in queries, and
+    # the database does the math instead of us loading every row:
+    #   select(InvoiceItem).where(InvoiceItem.total_with_vat > 1000)
+    #   select(func.sum(InvoiceItem.vat_amount))
+    
+    @hybrid_property
+    def subtotal(self):
+        """
+        Subtotal for this item (quantity * unit_price) as a float.
+        
+        In queries, InvoiceItem.subtotal is the SQL expression quantity * unit_price.
+        """
+        return float(self.subtotal_decimal())
     
-    @property
+    @subtotal.expression
+    def subtotal(cls):
+        return cls.quantity * cls.unit_price
+    
+    @hybrid_property
     def vat_amount(self):
         """
         Calculate VAT amount for this item.
@@ -440,20 +654,18 @@ class InvoiceItem(db.Model):
         
         Uses Decimal for precise calculations to avoid floating point errors.
         
-        Returns the VAT amount as a float.
+        Returns the VAT amount as a float. In queries, InvoiceItem.vat_amount
+        is the same formula as a SQL expression.
         """
-        # Calculate subtotal first (quantity * unit_price)
-        quantity_decimal = Decimal(str(self.quantity))
-        unit_price_decimal = Decimal(str(self.unit_price)) if not isinstance(self.unit_price, Decimal) else self.unit_price
-        subtotal = quantity_decimal * unit_price_decimal
-        
         # Calculate VAT: (subtotal * vat_rate) / 100
-        vat_rate_decimal = Decimal(str(self.vat_rate))
-        vat_amount = (subtotal * vat_rate_decimal) / Decimal('100')
-        
-        return float(vat_amount)
+        # vat_rate is an Integer column, and Decimal * int stays exact
+        return float(self.subtotal_decimal() * self.vat_rate / 100)
+    
+    @vat_amount.expression
+    def vat_amount(cls):
+        return cls.quantity * cls.unit_price * cls.vat_rate / 100.0
     
-    @property
+    @hybrid_property
     def total_with_vat(self):
         """
         Calculate total for this item including VAT.
@@ -462,27 +674,37 @@ class InvoiceItem(db.Model):
         
         Uses Decimal for precise calculations.
         
-        Returns the total including VAT as a float.
+        Returns the total including VAT as a float. In queries,
+        InvoiceItem.total_with_vat is the same formula as a SQL expression.
         """
-        # Calculate subtotal (price * quantity)
-        quantity_decimal = Decimal(str(self.quantity))
-        unit_price_decimal = Decimal(str(self.unit_price)) if not isinstance(self.unit_price, Decimal) else self.unit_price
-        subtotal = quantity_decimal * unit_price_decimal
-        
-        # Add VAT amount
-        vat_rate_decimal = Decimal(str(self.vat_rate))
-        vat_amount = (subtotal * vat_rate_decimal) / Decimal('100')
-        total = subtotal + vat_amount
+        # Calculate subtotal (price * quantity) and add the VAT amount
+        subtotal = self.subtotal_decimal()
+        total = subtotal + subtotal * self.vat_rate / 100
         
         return float(total)
     
+    @total_with_vat.expression
+    def total_with_vat(cls):
+        subtotal = cls.quantity * cls.unit_price
+        return subtotal + subtotal * cls.vat_rate / 100.0
+    
     def to_dict(self):
         """
         Convert InvoiceItem object to dictionary with calculated values.
         
         We include calculated subtotals and totals so consumers
-        don't need to recalculate them.
+        don't need to recalculate them. The subtotal is computed once and
+        reused for every derived value, instead of letting each of the four
+        helper methods multiply quantity * unit_price again.
         """
+        subtotal = self.subtotal_decimal()
+        vat_amount = subtotal * self.vat_rate / 100
+        
+        # Same Decimal arithmetic as calculate_total_with_tax()
+        total_with_tax = subtotal
+        if self.tax_rate:
+            total_with_tax += subtotal * to_decimal(self.tax_rate) / 100
+        
         return {
             'id': self.id,
             'invoice_id': self.invoice_id,
@@ -491,14 +713,75 @@ class InvoiceItem(db.Model):
             'unit_price': float(self.unit_price),
             'tax_rate': float(self.tax_rate) if self.tax_rate else 0.0,
             'vat_rate': int(self.vat_rate),
-            'subtotal': self.calculate_subtotal(),
-            'vat_amount': self.vat_amount,
-            'total_with_tax': self.calculate_total_with_tax(),
-            'total_with_vat': self.total_with_vat,
+            'subtotal': float(subtotal),
+            'vat_amount': float(vat_amount),
+            'total_with_tax': float(total_with_tax),
+            'total_with_vat': float(subtotal + vat_amount),
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 
+# STORED INVOICE TOTALS:
+# =====================
+#
+# Invoice.subtotal and Invoice.vat_total are recomputed whenever an InvoiceItem
+# is inserted, updated or deleted through the session. The item events only
+# remember which invoices were touched; after the flush one SELECT loads the
+# quantity/price/VAT columns of their items, sum_item_totals() adds them up with
+# Decimal (the same helper the invoice breakdown uses), and one UPDATE per
+# invoice stores the result. A SQL SUM() is not used here: SQLite computes it
+# in floating point, so 1.715 could be stored as 1.71 instead of 1.72.
+#
+# NOTE: bulk query.update()/query.delete() bypass these events - call
+# refresh_invoice_totals() yourself after using them.
+
+def refresh_invoice_totals(session, invoice_ids):
+    """Recompute the stored totals of the given invoices and update the in-memory values."""
+    invoice_ids = set(invoice_ids)
+    connection = session.connection()
+    
+    # One query for the items of all invoices, grouped by invoice in Python
+    items_by_invoice = {invoice_id: [] for invoice_id in invoice_ids}
+    rows = connection.execute(
+        select(InvoiceItem.invoice_id, InvoiceItem.quantity, InvoiceItem.unit_price, InvoiceItem.vat_rate)
+        .where(InvoiceItem.invoice_id.in_(invoice_ids)))
+    for invoice_id, quantity, unit_price, vat_rate in rows:
+        items_by_invoice[invoice_id].append((quantity, unit_price, vat_rate))
+    
+    invoices = Invoice.__table__
+    for invoice_id, items in items_by_invoice.items():
+        subtotal, vat_total = sum_item_totals(items)
+        connection.execute(invoices.update().where(invoices.c.id == invoice_id).values(
+            subtotal=subtotal, vat_total=vat_total))
+        invoice = session.identity_map.get(session.identity_key(Invoice, invoice_id))
+        if invoice is not None:
+            # The loaded invoice gets the new values directly, without a reload
+            set_committed_value(invoice, 'subtotal', subtotal)
+            set_committed_value(invoice, 'vat_total', vat_total)
+
+
+@event.listens_for(InvoiceItem, 'after_insert')
+@event.listens_for(InvoiceItem, 'after_update')
+@event.listens_for(InvoiceItem, 'after_delete')
+def mark_invoice_totals_dirty(mapper, connection, target):
+    """Remember which invoices need their stored totals recomputed after this flush."""
+    session = object_session(target)
+    if session is None:
+        return
+    dirty = session.info.setdefault('dirty_invoice_totals', set())
+    dirty.add(target.invoice_id)
+    # An item moved to another invoice changes the totals of both invoices
+    dirty.update(i for i in inspect(target).attrs.invoice_id.history.deleted if i is not None)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def update_invoice_totals(session, flush_context):
+    """Recompute stored totals for every invoice whose items changed in the flush."""
+    dirty = session.info.pop('dirty_invoice_totals', None)
+    if dirty:
+        refresh_invoice_totals(session, dirty)
+
+
 class Expense(db.Model):
     """
     Expense (Išlaidos) Model
@@ -529,13 +812,19 @@ class Expense(db.Model):
     
     __tablename__ = 'expenses'
     
+    # Expense lists are filtered by date range and category
+    __table_args__ = (
+        db.Index('ix_expenses_date_category', 'date', 'category'),
+    )
+    
     # Primary key: unique identifier for each expense
     id = db.Column(db.Integer, primary_key=True)
     
     # Expense date - when the expense was incurred
     # We use Date (not DateTime) because we typically only care about the day
-    # default=datetime.utcnow().date sets today's date as default
-    date = db.Column(db.Date, default=datetime.utcnow().date, nullable=False)
+    # server_default=func.current_date() lets the database fill in today's date
+    # when the row is inserted (see Invoice.invoice_date)
+    date = db.Column(db.Date, server_default=func.current_date(), nullable=False)
     
     # Category - predefined category for the expense
     # We use String(50) to limit length
@@ -552,9 +841,9 @@ class Expense(db.Model):
     amount = db.Column(db.Numeric(10, 2), nullable=False)
     
     # VAT Amount - the VAT portion of the expense
-    # We use Float for VAT amount (defaults to 0.0 if not specified)
+    # We use Numeric(10, 2) like amount (defaults to 0 if not specified)
     # This allows tracking VAT separately from the total amount
-    vat_amount = db.Column(db.Float, default=0.0, nullable=False)
+    vat_amount = db.Column(db.Numeric(10, 2), default=0, nullable=False)
     
     # Description - optional details about the expense
     # Text type allows for longer descriptions
@@ -593,11 +882,13 @@ class Expense(db.Model):
         """
         # Query all expenses and sum their amounts
         # We use func.sum() from SQLAlchemy for efficient database-level summation
-        from sqlalchemy import func
+        # and the 2.0-style select() + session.execute(), which skips the legacy
+        # Query object's ORM entity setup (there are no entities, just one number);
+        # the compiled statement is reused from the engine's query cache
         
         # Get the sum of all expense amounts
         # If no expenses exist, result will be None, so we default to 0
-        total = db.session.query(func.sum(Expense.amount)).scalar()
+        total = db.session.execute(select(func.sum(Expense.amount))).scalar()
         
         # Convert to float, handling None case
         if total is None:
@@ -606,6 +897,47 @@ class Expense(db.Model):
         # Convert Decimal to float for return value
         return float(total)
     
+    @staticmethod
+    def totals_by_category():
+        """
+        Calculate the expense total of every category in one query.
+        
+        Uses a single SELECT category, SUM(amount) ... GROUP BY category
+        instead of one SUM query per category, so a dashboard showing all
+        categories costs one round-trip to the database.
+        
+        Returns:
+            dict: {category: total amount as float}, only categories with expenses
+        """
+        rows = db.session.execute(
+            select(Expense.category, func.sum(Expense.amount)).group_by(Expense.category)).all()
+        return {category: float(total or 0) for category, total in rows}
+    
+    @staticmethod
+    def totals_by_month():
+        """
+        Calculate the expense total of every month in one query.
+        
+        The month key ('2024-01') is computed by the database. There is no
+        portable SQL function for that, so we pick the one the current
+        database understands (strftime on SQLite, to_char on PostgreSQL,
+        date_format on MySQL).
+        
+        Returns:
+            dict: {'YYYY-MM': total amount as float}, ordered by month
+        """
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            month = func.to_char(Expense.date, 'YYYY-MM')
+        elif dialect in ('mysql', 'mariadb'):
+            month = func.date_format(Expense.date, '%Y-%m')
+        else:
+            month = func.strftime('%Y-%m', Expense.date)
+        
+        rows = db.session.execute(
+            select(month, func.sum(Expense.amount)).group_by(month).order_by(month)).all()
+        return {month_key: float(total or 0) for month_key, total in rows}
+    
     def to_dict(self):
         """
         Convert Expense object to dictionary.
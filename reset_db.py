@@ -13,6 +13,7 @@ Usage:
 # Import app and db from app.py
 # The app instance is created at the bottom of app.py
 from app import app, db
+from sqlalchemy import select
 from werkzeug.security import generate_password_hash
 
 # Wrap the logic in app context
@@ -22,17 +23,19 @@ with app.app_context():
     print("RESETTING DATABASE SCHEMA")
     print("=" * 60)
     
-    # STEP 1: Drop all existing tables
-    # This deletes the old buggy database structure
-    print("\n1. Dropping all existing tables...")
-    db.drop_all()
-    print("   ✓ All tables dropped")
-    
-    # STEP 2: Create all tables with current schema
-    # This creates the new database with the vat_amount column
-    print("\n2. Creating new tables with latest schema...")
-    db.create_all()
-    print("   ✓ All tables created (including vat_amount column in expenses)")
+    # STEP 1 & 2: Drop all existing tables and create them with the current schema
+    # Both run on one connection inside a single transaction, so the reset
+    # either fully happens or (on databases with transactional DDL) not at all
+    with db.engine.begin() as connection:
+        # This deletes the old buggy database structure
+        print("\n1. Dropping all existing tables...")
+        db.metadata.drop_all(connection)
+        print("   ✓ All tables dropped")
+        
+        # This creates the new database with the vat_amount column
+        print("\n2. Creating new tables with latest schema...")
+        db.metadata.create_all(connection)
+        print("   ✓ All tables created (including vat_amount column in expenses)")
     
     # STEP 3: Create the admin user again
     print("\n3. Creating admin user...")
@@ -42,7 +45,7 @@ with app.app_context():
         from models import User
         
         # Check if admin user already exists (shouldn't after drop_all, but just in case)
-        admin_user = User.query.filter_by(username='admin').first()
+        admin_user = db.session.execute(select(User).filter_by(username='admin')).scalar_one_or_none()
         
         if not admin_user:
             # Create admin user with password 'admin'
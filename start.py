@@ -5,42 +5,168 @@ Paprastas būdas paleisti Flask programą.
 Tiesiog paleiskite: python3 start.py
 """
 
+import os
+import random
 import socket
+from pathlib import Path
 from app import app
 
-def find_free_port(start_port=3000, max_attempts=100):
+# Čia įrašomas paskutinis sėkmingai naudotas portas, kad kitas paleidimas
+# pirmiausia bandytų tą patį (ir naršyklėje atidarytas adresas liktų galioti).
+# launcher.py naudoja tą patį failą (SERVER_PORT_FILE), kad rastų jau veikiantį serverį
+PORT_CACHE_FILE = Path(os.path.expanduser('~/.cache/laimis/port'))
+
+def is_port_available(port):
+    """
+    Patikrina, ar portas tikrai laisvas (dviem žingsniais).
+    
+    HOW IT WORKS:
+    - 1) Bando užimti portą su SO_REUSEADDR (kaip tai daro ir Flask/Werkzeug
+      serveris), todėl portas, likęs TIME_WAIT būsenoje po ką tik sustabdyto
+      serverio, laikomas laisvu
+    - 2) Bando prisijungti prie porto - jei kažkas jau klauso (pvz. Windows
+      leidžia bind() su SO_REUSEADDR net ant užimto porto), portas užimtas
+    - Portas laisvas tik tada, kai bind() pavyko IR prisijungti nepavyko
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind(('127.0.0.1', port))
+            s.listen(1)
+    except OSError:
+        return False
+    
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=0.05):
+            return False
+    except (OSError, OverflowError):
+        return True
+
+
+def find_ephemeral_port():
     """
-    Randa laisvą portą, pradedant nuo start_port.
+    Paprašo operacinės sistemos laisvo porto (bind į portą 0).
     
     HOW IT WORKS:
-    - Bando sukurti socket'ą ant kiekvieno porto
-    - Jei portas užimtas, bando kitą
+    - Branduolys pats žino, kurie portai laisvi, todėl bind(('127.0.0.1', 0))
+      iš karto gauna laisvą portą - nereikia tikrinti portų po vieną
+    - getsockname() grąžina portą, kurį priskyrė sistema
+    - Socket'as uždaromas, o portą vėliau užima app.run()
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def find_free_port(start_port=3000, max_attempts=100, start_offset=None):
+    """
+    Randa laisvą portą intervale [start_port, start_port + max_attempts).
+    
+    Naudojama tik tada, kai portas turi būti iš konkretaus intervalo
+    (START_PORT=3000 python3 start.py). Kitaip užtenka find_cached_port().
+    
+    HOW IT WORKS:
+    - Paieška pradedama nuo atsitiktinio poslinkio intervale, todėl keli
+      vienu metu paleisti procesai nesigrumia dėl tų pačių pirmų portų
+    - Pasiekus intervalo galą, tęsiama nuo start_port (ratu)
+    - start_offset=0 grąžina seną tvarką: 3000, 3001, ...
+    - Tikrina kiekvieną portą su is_port_available()
     - Grąžina pirmą laisvą portą
     """
-    for port in range(start_port, start_port + max_attempts):
-        try:
-            # Bandoma sukurti socket'ą ant porto
-            # Jei pavyks, portas laisvas
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.bind(('127.0.0.1', port))
-                return port
-        except OSError:
-            # Portas užimtas, bandoma kitą
-            continue
-    # Jei nerasta laisvo porto, naudojame paskutinį
+    if start_offset is None:
+        # random jau inicializuotas iš os.urandom, todėl skirtingi procesai
+        # gauna skirtingus poslinkius ir be papildomo seed()
+        start_offset = random.randrange(max_attempts)
+    
+    for i in range(max_attempts):
+        port = start_port + (start_offset + i) % max_attempts
+        if is_port_available(port):
+            return port
+    # Jei nerasta laisvo porto, naudojame pirmąjį
     return start_port
 
+
+def save_port(port):
+    """
+    Įrašo portą į PORT_CACHE_FILE (jį skaito ir launcher.py).
+    
+    Jei įrašyti nepavyksta (pvz. nėra teisių), tiesiog tęsiame be cache.
+    """
+    try:
+        os.makedirs(PORT_CACHE_FILE.parent, exist_ok=True)
+        PORT_CACHE_FILE.write_text(str(port))
+    except OSError:
+        pass
+
+
+def find_cached_port():
+    """
+    Pirmiausia bando praėjusio paleidimo portą, kitaip gauna naują.
+    
+    HOW IT WORKS:
+    - Perskaito portą iš PORT_CACHE_FILE ir patikrina jį su is_port_available()
+    - Jei failo nėra, jis sugadintas arba portas užimtas - naudoja
+      find_ephemeral_port()
+    - Rastą portą įrašo atgal į failą su save_port()
+    """
+    try:
+        port = int(PORT_CACHE_FILE.read_text().strip())
+        if 0 < port < 65536 and is_port_available(port):
+            return port
+    except (OSError, ValueError):
+        pass
+    
+    port = find_ephemeral_port()
+    save_port(port)
+    return port
+
+
 if __name__ == '__main__':
-    # Automatiškai rasti laisvą portą
-    # Pradedame nuo 3000, nes šis portas retai būna užimtas
-    port = find_free_port(3000)
+    # Debug režimas (automatinis perkrovimas pakeitus kodą) tik paprašius:
+    # FLASK_DEBUG=1 python3 start.py
+    # Reloader'is paleidžia antrą procesą ir importuoja programą dar kartą,
+    # todėl įprastam paleidimui jis tik lėtina startą ir naudoja daugiau atminties
+    debug = os.environ.get('FLASK_DEBUG') == '1'
     
-    print("=" * 50)
-    print("Paleidžiama Mano Startuolis programa...")
-    print("=" * 50)
-    print(f"\nAtidarykite naršyklėje: http://localhost:{port}")
-    print("\nNorėdami sustabdyti, paspauskite CTRL+C\n")
-    print("=" * 50)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Debug režime šis failas paleidžiamas antrą kartą (reloader'io vaikinis
+        # procesas). Portą jau užėmė pirmasis procesas ir perdavė jį čia, todėl
+        # naujo porto neieškome - kitaip gautume kitą portą ir perrašytume cache
+        port = int(os.environ['PORT'])
+    else:
+        if os.environ.get('START_PORT'):
+            # Paprašyta porto iš konkretaus intervalo:
+            # START_PORT=3000 python3 start.py -> laisvas portas iš 3000-3099
+            # (paieška prasideda atsitiktinėje vietoje, žr. find_free_port())
+            port = find_free_port(int(os.environ['START_PORT']))
+            save_port(port)
+        else:
+            # Automatiškai rasti laisvą portą
+            # Bandome praėjusio paleidimo portą, kitaip laisvą portą parenka sistema
+            port = find_cached_port()
+        os.environ['PORT'] = str(port)
+        
+        print("=" * 50)
+        print("Paleidžiama Mano Startuolis programa...")
+        print("=" * 50)
+        print(f"\nAtidarykite naršyklėje: http://localhost:{port}")
+        print("\nNorėdami sustabdyti, paspauskite CTRL+C\n")
+        print("=" * 50)
     
     # Paleisti serverį ant rasto porto
-    app.run(debug=True, host='127.0.0.1', port=port)
+    # Jei įdiegtas waitress (pip install waitress), naudojame jį vietoj
+    # Flask'o kūrimo serverio: tikras gijų telkinys ir greitesnis užklausų
+    # apdorojimas. Debug režimui reikia Flask'o reloader'io, todėl tada ne
+    serve = None
+    if not debug:
+        try:
+            from waitress import serve
+        except ImportError:
+            pass
+    
+    if serve is not None:
+        serve(app, host='127.0.0.1', port=port, threads=8)
+    else:
+        # threaded=True - užklausos aptarnaujamos lygiagrečiai, ne po vieną
+        app.run(debug=debug, use_reloader=debug, host='127.0.0.1', port=port, threaded=True)
@@ -35,8 +35,16 @@ This is a standard practice in software development - always test against a sepa
 
 import unittest
 from datetime import datetime, date
-from app import create_app
-from models import db, Client, Invoice
+from decimal import Decimal
+from flask import Flask
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.pool import StaticPool
+from models import db, Client, Invoice, InvoiceItem
+
+# Set up all model relationships now, at import time, instead of inside
+# whichever test happens to touch a model first. A broken relationship
+# then fails here with a clear error rather than in the middle of a test.
+configure_mappers()
 
 
 class AccountingTests(unittest.TestCase):
@@ -44,55 +52,102 @@ class AccountingTests(unittest.TestCase):
     Test suite for the accounting system.
     
     Each test method (starting with 'test_') is automatically discovered and run by unittest.
-    setUp() runs before each test - creates a fresh database.
-    tearDown() runs after each test - cleans up.
+    setUpClass() runs once - creates the app and the database tables.
+    tearDown() runs after each test - empties the tables again.
     """
     
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         """
-        Set up test environment before each test runs.
+        Set up test environment once, before the first test runs.
         
-        This method is called automatically before every test_* method.
-        We create a Flask app with in-memory database here.
+        Creating the app and all tables is the slowest part of these tests,
+        so we do it only once for the whole class instead of before every test.
         """
-        # Create Flask app with test configuration
-        # We pass a test config that uses in-memory database
-        self.app = create_app()
+        # Create a small Flask app just for the tests
+        # app.py builds its own app at import time without a database, so the
+        # tests set up their own app and connect db (from models.py) to it
+        cls.app = Flask(__name__)
         
-        # Override the database URI to use in-memory SQLite
+        # Use in-memory SQLite instead of the real database
         # ':memory:' creates a database that exists only in RAM
         # It's automatically deleted when the connection closes
-        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        cls.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        
+        # Every new connection to ':memory:' would get its own empty database,
+        # so all connections must share a single one (StaticPool).
+        # check_same_thread=False lets that one connection be used from any thread
+        cls.app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'poolclass': StaticPool,
+            'connect_args': {'check_same_thread': False},
+        }
         
         # Disable CSRF protection for testing (not needed for unit tests)
-        self.app.config['TESTING'] = True
+        cls.app.config['TESTING'] = True
+        
+        # Don't track every object change for Flask signals and don't log SQL
+        cls.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        cls.app.config['SQLALCHEMY_ECHO'] = False
+        
+        # Connect db to the app - this reads the config above, so it must
+        # come after all SQLALCHEMY_* settings
+        db.init_app(cls.app)
         
         # Create application context
         # Flask requires this to access the database
-        self.app_context = self.app.app_context()
-        self.app_context.push()
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
         
         # Create all database tables in the in-memory database
-        # This creates fresh tables for each test
+        # The tables are shared by all tests; tearDown() empties them
         db.create_all()
+        
+        # Session settings for tests:
+        # - autoflush=False: SQL is sent only on commit(), not before every query
+        # - expire_on_commit=False: objects keep their loaded values after
+        #   commit(), so the assertions don't reload them from the database
+        db.session.configure(autoflush=False, expire_on_commit=False)
+    
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Clean up once, after the last test has run.
+        """
+        # Restore the default session settings (db is shared with the app)
+        db.session.configure(autoflush=True, expire_on_commit=True)
+        
+        # Close the shared connection
+        # The in-memory database (with all its tables) disappears with it,
+        # so there is no need to drop the tables one by one
+        db.engine.dispose()
+        
+        # Remove application context
+        cls.app_context.pop()
     
     def tearDown(self):
         """
         Clean up after each test runs.
         
         This method is called automatically after every test_* method.
-        We remove all data and close the database connection.
+        We delete all rows so the next test starts with empty tables.
+        
+        NOTE: we don't roll back an outer transaction here (a common recipe),
+        because Flask-SQLAlchemy's session always picks its own engine and
+        ignores a connection passed with db.session.configure(bind=...).
+        Deleting the rows of a few small tables is just as cheap.
         """
-        # Remove all data from database
-        # This ensures each test starts with a clean slate
-        db.session.remove()
+        # Drop anything a failed test left uncommitted
+        db.session.rollback()
         
-        # Drop all tables
-        # This completely cleans up the in-memory database
-        db.drop_all()
+        # Remove all data from database
+        # Children first (invoice items before invoices, invoices before clients)
+        # so foreign keys are never violated
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
         
-        # Remove application context
-        self.app_context.pop()
+        # Close the session used by the test
+        db.session.remove()
     
     def test_create_client(self):
         """
@@ -128,6 +183,10 @@ class AccountingTests(unittest.TestCase):
         # Query the database to retrieve the client we just saved
         # We use the client's ID to find it
         # Using db.session.get() is the modern way (avoids deprecation warnings)
+        # expire_all() makes the session forget the loaded values, so get()
+        # really reads the row back from the database instead of just
+        # returning the object it already holds in memory
+        db.session.expire_all()
         saved_client = db.session.get(Client, new_client.id)
         
         # STEP 5: Assertions - verify the data is correct
@@ -149,9 +208,9 @@ class AccountingTests(unittest.TestCase):
                         "Client phone should match what we saved")
         
         # Check that ID was automatically assigned
-        # The database should have given it an ID (1, since it's the first record)
+        # We don't check the exact number - it depends on what earlier tests
+        # inserted into the shared tables
         self.assertIsNotNone(saved_client.id, "Client should have an ID assigned")
-        self.assertEqual(saved_client.id, 1, "First client should have ID = 1")
     
     def test_create_invoice_with_client_relationship(self):
         """
@@ -171,28 +230,29 @@ class AccountingTests(unittest.TestCase):
             name="Invoice Test Client",
             email="invoice@example.com"
         )
-        db.session.add(test_client)
-        db.session.commit()
-        
-        # Verify client was saved (basic sanity check)
-        self.assertIsNotNone(test_client.id, "Client should have an ID")
         
         # STEP 2: Create an Invoice linked to the client
-        # We use client_id to link the invoice to the client
-        # This is the foreign key relationship
+        # We assign the client object itself (the relationship), not client_id.
+        # SQLAlchemy inserts the client first and fills in client_id for us,
+        # so we don't need to save the client separately to learn its ID
         new_invoice = Invoice(
             invoice_number="INV-TEST-001",
-            client_id=test_client.id,  # This links invoice to client
+            client=test_client,  # This links invoice to client
             invoice_date=date.today(),
             status="pending"
         )
         
-        # STEP 3: Save invoice to database
-        db.session.add(new_invoice)
+        # STEP 3: Save client and invoice to database with a single commit
+        db.session.add_all([test_client, new_invoice])
         db.session.commit()
         
+        # Verify client was saved (basic sanity check)
+        self.assertIsNotNone(test_client.id, "Client should have an ID")
+        
         # STEP 4: Verify invoice was saved
         # Using db.session.get() is the modern way (avoids deprecation warnings)
+        # With expire_on_commit=False this is answered from the session's
+        # identity map (no SQL) - test_create_client already checks the round trip
         saved_invoice = db.session.get(Invoice, new_invoice.id)
         self.assertIsNotNone(saved_invoice, "Invoice should be saved in database")
         
@@ -221,7 +281,7 @@ class AccountingTests(unittest.TestCase):
         # STEP 7: Test reverse relationship (client.invoices)
         # The Client model has a relationship back to invoices
         # We should be able to access all invoices for a client
-        client_invoices = test_client.invoices.all()  # .all() executes the query
+        client_invoices = test_client.invoices  # lazy='select' returns a plain list
         
         # Verify the client has one invoice
         self.assertEqual(len(client_invoices), 1,
@@ -230,6 +290,161 @@ class AccountingTests(unittest.TestCase):
         # Verify it's the correct invoice
         self.assertEqual(client_invoices[0].invoice_number, "INV-TEST-001",
                         "Client's invoice should be the one we created")
+    
+    def create_invoice(self, invoice_number, items):
+        """
+        Helper: save a new invoice with the given (quantity, unit_price, vat_rate) items.
+        
+        Prices are passed as strings so they become exact Decimals.
+        """
+        client = Client(name=f"Client {invoice_number}")
+        invoice = Invoice(invoice_number=invoice_number, client=client)
+        for quantity, unit_price, vat_rate in items:
+            invoice.items.append(InvoiceItem(
+                description="Item",
+                quantity=Decimal(quantity),
+                unit_price=Decimal(unit_price),
+                vat_rate=vat_rate,
+            ))
+        db.session.add(invoice)
+        db.session.commit()
+        return invoice
+    
+    def reload_invoice(self, invoice_id):
+        """
+        Helper: read an invoice back from the database, with its items NOT loaded,
+        so calculate_total() has to use the stored subtotal/vat_total columns.
+        """
+        db.session.expire_all()
+        invoice = db.session.get(Invoice, invoice_id)
+        db.session.expire(invoice, ['items'])
+        return invoice
+    
+    def test_stored_totals_match_item_sums(self):
+        """
+        Test 3: The stored invoice totals equal the sum of the items, rounded once.
+        
+        The items add up to exactly 1.715 (0.05 + 1.05 + 0.615). Rounded
+        half-up that is 1.72 - a floating point SUM() in SQLite gives
+        1.7149999... and used to store 1.71. The stored columns, the
+        breakdown and list_with_totals() must all show the same cents.
+        """
+        invoice = self.create_invoice("INV-TOTALS-001", [
+            ("1", "0.05", 0),
+            ("3", "0.35", 0),
+            ("1.5", "0.41", 0),
+        ])
+        
+        # Stored columns, read back from the database
+        saved_invoice = self.reload_invoice(invoice.id)
+        self.assertEqual(saved_invoice.subtotal, Decimal("1.72"))
+        self.assertEqual(saved_invoice.vat_total, Decimal("0.00"))
+        self.assertEqual(saved_invoice.calculate_total(), 1.72)
+        
+        # Breakdown without loaded items (stored columns) gives the same result
+        breakdown = saved_invoice.calculate_totals_breakdown()
+        self.assertEqual(breakdown['subtotal'], 1.72)
+        self.assertEqual(breakdown['grand_total'], 1.72)
+        
+        # Breakdown from the loaded items gives the same result
+        self.assertEqual(len(saved_invoice.items), 3)  # loads the items
+        breakdown = saved_invoice.calculate_totals_breakdown()
+        self.assertEqual(breakdown['subtotal'], 1.72)
+        self.assertEqual(breakdown['grand_total'], 1.72)
+        
+        # The invoice list shows the same totals
+        listed = {row[0].id: row for row in Invoice.list_with_totals()}
+        _, subtotal, vat_total, grand_total, items_count = listed[invoice.id]
+        self.assertEqual((subtotal, vat_total, grand_total, items_count), (1.72, 0.0, 1.72, 3))
+        
+        # Subtotals with a half cent are rounded up, not down - the same way in
+        # the stored column, the breakdown of loaded items and the list.
+        # 2.5 x 0.01 + 0.06 = 0.085 exactly, but 0.08499999999999999 as a float sum
+        half_cent_cases = [
+            ([("1.005", "1", 0)], "1.01"),
+            ([("2.675", "1", 0)], "2.68"),
+            ([("10.235", "1", 0)], "10.24"),
+            ([("2.5", "0.01", 0), ("1", "0.06", 0)], "0.09"),
+        ]
+        for number, (items, expected) in enumerate(half_cent_cases):
+            invoice = self.create_invoice(f"INV-HALF-{number}", items)
+            self.assertEqual(self.reload_invoice(invoice.id).subtotal, Decimal(expected))
+            loaded_invoice = db.session.get(Invoice, invoice.id)
+            self.assertEqual(len(loaded_invoice.items), len(items))  # loads the items
+            self.assertEqual(loaded_invoice.calculate_totals_breakdown()['subtotal'], float(expected))
+            listed = {row[0].id: row for row in Invoice.list_with_totals()}
+            self.assertEqual(listed[invoice.id][1], float(expected))
+    
+    def test_total_includes_unflushed_item_changes(self):
+        """
+        Test 4: calculate_total() sees item changes that are not saved yet.
+        
+        The stored totals only change when items are flushed, so an invoice
+        with pending item changes must sum its items instead.
+        """
+        invoice = self.create_invoice("INV-PENDING-001", [("1", "10.00", 21)])
+        self.assertEqual(invoice.calculate_total(), 12.10)
+        
+        # A new item, not flushed yet
+        invoice.items.append(InvoiceItem(description="Extra", quantity=Decimal("1"),
+                                         unit_price=Decimal("100.00"), vat_rate=21))
+        self.assertEqual(invoice.calculate_total(), 133.10)
+        db.session.commit()
+        
+        # A changed price on an item loaded on its own, while invoice.items is not loaded
+        invoice = self.reload_invoice(invoice.id)
+        item = db.session.execute(
+            db.select(InvoiceItem).filter_by(invoice_id=invoice.id, description="Extra")).scalar_one()
+        item.unit_price = Decimal("50.00")
+        self.assertEqual(invoice.calculate_total(), 72.60)
+        db.session.commit()
+        
+        # After saving, the stored columns hold the same value
+        self.assertEqual(self.reload_invoice(invoice.id).calculate_total(), 72.60)
+    
+    def test_stored_totals_after_item_move_and_delete(self):
+        """
+        Test 5: Moving an item to another invoice updates both invoices,
+        and deleting an item updates its invoice.
+        """
+        first = self.create_invoice("INV-MOVE-001", [("1", "10.00", 0), ("2", "5.00", 0)])
+        second = self.create_invoice("INV-MOVE-002", [("1", "1.00", 0)])
+        
+        # Move the 2 x 5.00 item from the first invoice to the second
+        moved_item = first.items[1]
+        moved_item.invoice = second
+        db.session.commit()
+        
+        self.assertEqual(self.reload_invoice(first.id).subtotal, Decimal("10.00"))
+        self.assertEqual(self.reload_invoice(second.id).subtotal, Decimal("11.00"))
+        
+        # Delete the moved item again
+        db.session.delete(db.session.get(InvoiceItem, moved_item.id))
+        db.session.commit()
+        
+        self.assertEqual(self.reload_invoice(second.id).subtotal, Decimal("1.00"))
+    
+    def test_bulk_create_updates_stored_totals(self):
+        """
+        Test 6: InvoiceItem.bulk_create() skips the item events, so it must
+        recompute the stored totals itself.
+        """
+        invoice = self.create_invoice("INV-BULK-001", [])
+        self.assertEqual(invoice.calculate_total(), 0.0)
+        
+        InvoiceItem.bulk_create(invoice.id, [
+            {'description': "A", 'quantity': Decimal("2"), 'unit_price': Decimal("10.00"), 'vat_rate': 21},
+            {'description': "B", 'quantity': Decimal("1"), 'unit_price': Decimal("0.05"), 'vat_rate': 0},
+        ])
+        db.session.commit()
+        
+        saved_invoice = self.reload_invoice(invoice.id)
+        self.assertEqual(saved_invoice.subtotal, Decimal("20.05"))
+        self.assertEqual(saved_invoice.vat_total, Decimal("4.20"))
+        self.assertEqual(saved_invoice.calculate_total(), 24.25)
+        
+        # The invoice's items list also shows the new items
+        self.assertEqual(len(db.session.get(Invoice, invoice.id).items), 2)
 
 
 if __name__ == '__main__':